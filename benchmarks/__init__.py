@@ -0,0 +1 @@
+"""Benchmarks for the Music Library Toolkit. Run from the repo root, eg: python -m benchmarks.bench_scan"""
@@ -0,0 +1,108 @@
+"""
+Throughput of cleaning song titles and artists: the old per call re.sub and
+chained split versions vs mltk.normalize, one at a time (memoized) and in
+batches.
+
+    python -m benchmarks.bench_normalize --songs 1000000
+"""
+
+import argparse
+import random
+import re
+import time
+import unicodedata
+
+from mltk.normalize import (
+    clean_artist,
+    clean_artists,
+    clean_song_title,
+    clean_song_titles,
+    remove_accents,
+    remove_accents_many,
+)
+from .synth import fake_song
+
+MIXES = ["", " (Extended Mix)", " (Original Mix)", " [Radio Edit]", " (Dub)"]
+FEATURES = ["", " feat Someone", " & Friend", " vs Rival"]
+ACCENTED = ["Beyoncé", "Röyksopp", "Sigur Rós"]
+
+
+def old_clean_song_title(title):
+    if title:
+        title = re.sub(r"\([^\)]*\)", "", title)
+        title = re.sub(r"\[[^\]]*\]", "", title)
+        title = re.sub(r"[^0-9a-zA-Z ]+", "", title.lower())
+        return title.strip()
+    else:
+        return None
+
+
+def old_clean_artist(artist):
+    if artist:
+        artist = (
+            artist.lower()
+            .split(" ft ")[0]
+            .split(" feat ")[0]
+            .split(" & ")[0]
+            .split(" vs ")[0]
+        )
+        artist = re.sub(r"[^0-9a-zA-Z ]+", "", artist.lower())
+        return artist.strip()
+    else:
+        return None
+
+
+def old_remove_accents(input_str):
+    nfkd_form = unicodedata.normalize("NFKD", input_str)
+    return "".join([c for c in nfkd_form if not unicodedata.combining(c)])
+
+
+def make_songs(n_songs, seed=0):
+    """Titles and artists with mixes, featured artists and a few accents"""
+    rng = random.Random(seed)
+    titles, artists = [], []
+    for i in range(n_songs):
+        song = fake_song(i, rng)
+        titles.append(song["title"] + rng.choice(MIXES))
+        artist = song["artist"] if rng.random() > 0.05 else rng.choice(ACCENTED)
+        artists.append(artist + rng.choice(FEATURES))
+    return titles, artists
+
+
+def one_at_a_time(titles, artists, clean_title, clean_artist, remove_accents):
+    for title, artist in zip(titles, artists):
+        clean_title(title)
+        clean_artist(remove_accents(artist))
+
+
+def batched(titles, artists):
+    clean_song_titles(titles)
+    clean_artists(remove_accents_many(artists))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--songs", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    titles, artists = make_songs(args.songs)
+    runs = [
+        ("old", one_at_a_time, old_clean_song_title, old_clean_artist, old_remove_accents),
+        ("normalize", one_at_a_time, clean_song_title, clean_artist, remove_accents),
+        ("normalize batch", batched),
+    ]
+
+    print(f"{'method':<20}{'seconds':>10}{'songs/s':>12}")
+    for label, func, *funcs in runs:
+        secs = timed(func, titles, artists, *funcs)
+        print(f"{label:<20}{secs:>10.2f}{args.songs / secs:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Throughput of scanning mp3 tags: eyed3.load one file at a time (how
+music_dir_to_json used to work) vs mltk.scanner with an increasing number of
+worker processes.
+
+    python -m benchmarks.bench_scan --files 5000
+"""
+
+import argparse
+import eyed3
+import os
+import tempfile
+import time
+
+from mltk.scanner import list_mp3s, scan_tags
+from .synth import make_mp3_library
+
+
+def bench_eyed3(paths):
+    for path in paths:
+        audio = eyed3.load(path)
+        audio.tag.artist, audio.tag.title
+
+
+def bench_scanner(paths, workers):
+    for _ in scan_tags(paths, workers=workers):
+        pass
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--subdirs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_mp3_library(tmp, args.files, subdirs=args.subdirs)
+        paths = list_mp3s(tmp, recursive=True)
+
+        print(f"{'method':<20}{'seconds':>10}{'files/s':>12}")
+        secs = timed(bench_eyed3, paths)
+        print(f"{'eyed3.load':<20}{secs:>10.2f}{len(paths) / secs:>12.0f}")
+
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            secs = timed(bench_scanner, paths, workers)
+            label = f"scanner x{workers}"
+            print(f"{label:<20}{secs:>10.2f}{len(paths) / secs:>12.0f}")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
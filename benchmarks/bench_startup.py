@@ -0,0 +1,87 @@
+"""
+Startup time of the command line: `main.py ... --help` for each command, and
+an offline scan of a small library (music_dir_to_json, no spotify calls).
+Each is run in a fresh interpreter several times and the median reported.
+
+    python -m benchmarks.bench_startup --runs 5 --importtime
+    python -m benchmarks.bench_startup --budget-ms 500   # exits 1 if over
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .synth import make_mp3_library
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCAN = "from mltk.spotiply import music_dir_to_json; music_dir_to_json({!r}, {!r})"
+
+
+def commands(music_dir, out_file):
+    return {
+        "main.py --help": ["main.py", "--help"],
+        "spotiply --help": ["main.py", "spotiply", "--help"],
+        "tag_utils --help": ["main.py", "tag_utils", "--help"],
+        "offline scan": ["-c", SCAN.format(music_dir, out_file)],
+    }
+
+
+def run(args, python_flags=()):
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, *python_flags, *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, out.stderr
+
+
+def slowest_imports(args, n=10):
+    """The n slowest top level imports of a command, by cumulative microseconds"""
+    _, stderr = run(args, python_flags=["-X", "importtime"])
+    imports = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            # top level imports aren't indented
+            if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+                imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--importtime", action="store_true")
+    parser.add_argument("--budget-ms", type=float)
+    args = parser.parse_args()
+
+    over_budget = False
+    with tempfile.TemporaryDirectory() as tmp:
+        music_dir = os.path.join(tmp, "music")
+        make_mp3_library(music_dir, args.files)
+        out_file = os.path.join(tmp, "songs.json")
+
+        print(f"{'command':<20}{'median ms':>10}{'min ms':>10}")
+        for label, cmd in commands(music_dir, out_file).items():
+            times = [1000 * run(cmd)[0] for _ in range(args.runs)]
+            median = statistics.median(times)
+            print(f"{label:<20}{median:>10.0f}{min(times):>10.0f}")
+            over_budget |= args.budget_ms is not None and median > args.budget_ms
+
+            if args.importtime:
+                for us, name in slowest_imports(cmd):
+                    print(f"    {name:<36}{us / 1000:>8.1f}ms")
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+A local stand-in for the parts of the spotify web api mltk uses, for the
+benchmarks. Every request can be delayed (latency) and some answered with a
+429 (throttle), and the server counts the requests it gets per endpoint.
+Errors can also be injected per endpoint (failures), answered after the
+request has been carried out, like a server failing to respond.
+
+    with FakeSpotify(latency=0.02, throttle=0.01) as server:
+        sp = server.client()
+        sp.search(q="one more time artist:daft punk", limit=5, type="track")
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# constants
+RETRY_AFTER = 0  # seconds, sent with the 429s
+DURATION_MS = 240000
+
+
+def track_id(artist, title):
+    return hashlib.md5(f"{artist}|{title}".encode()).hexdigest()[:22]
+
+
+class FakeSpotify(ThreadingHTTPServer):
+    """
+    Serves search, me, playlist create/add/items/remove and saved tracks.
+    Strict searches ("title artist:artist") find the song unless it's one of
+    the `miss_rate` fraction picked (by hash) to miss; other queries miss.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, latency=0.0, throttle=0.0, miss_rate=0.1, liked=0, seed=0, failures=None
+    ):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.latency = latency
+        self.throttle = throttle
+        self.miss_rate = miss_rate
+        self.liked = liked
+        self.rng = random.Random(seed)
+        # endpoint -> statuses (or None for no error) of its next responses
+        self.failures = {name: list(codes) for name, codes in (failures or {}).items()}
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.throttled = 0
+        self.playlists = {}
+        self.thread = None
+
+    @property
+    def prefix(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/"
+
+    def client(self, **kwargs):
+        """A spotipy client pointed at this server"""
+        import spotipy
+        from mltk.spotiply import spotify_session
+
+        kwargs.setdefault("requests_session", spotify_session())
+        sp = spotipy.Spotify(auth="fake-token", **kwargs)
+        sp.prefix = self.prefix
+        return sp
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "throttled": self.throttled}
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    # endpoints, each returning (status, body)
+
+    def search(self, params, body):
+        q = params.get("q", [""])[0]
+        limit = int(params.get("limit", ["10"])[0])
+        if " artist:" not in q:
+            return 200, {"tracks": {"items": [], "total": 0}}
+
+        title, artist = q.split(" artist:", 1)
+        digest = int(hashlib.md5(q.encode()).hexdigest(), 16)
+        if digest % 1000 < self.miss_rate * 1000:
+            return 200, {"tracks": {"items": [], "total": 0}}
+
+        items = [self.track(artist, title)]
+        # a few worse candidates after the right one
+        for i in range(1, limit):
+            items.append(self.track(f"{artist} tribute {i}", f"{title} cover"))
+        return 200, {"tracks": {"items": items, "total": len(items)}}
+
+    def track(self, artist, title):
+        return {
+            "id": track_id(artist, title),
+            "name": title,
+            "artists": [{"name": artist}],
+            "duration_ms": DURATION_MS,
+        }
+
+    def me(self, params, body):
+        return 200, {"id": "bench"}
+
+    def create_playlist(self, params, body, user):
+        with self.lock:
+            playlist_id = f"playlist{len(self.playlists)}"
+            self.playlists[playlist_id] = []
+        return 201, {"id": playlist_id, "name": body.get("name")}
+
+    def add_items(self, params, body, playlist_id):
+        with self.lock:
+            self.playlists[playlist_id] += [uri.split(":")[-1] for uri in body]
+        return 201, {"snapshot_id": "x"}
+
+    def remove_items(self, params, body, playlist_id):
+        remove = {t["uri"].split(":")[-1] for t in body["tracks"]}
+        with self.lock:
+            self.playlists[playlist_id] = [
+                id for id in self.playlists[playlist_id] if id not in remove
+            ]
+        return 200, {"snapshot_id": "x"}
+
+    def playlist_items(self, params, body, playlist_id):
+        ids = self.playlists.get(playlist_id, [])
+        items = [{"track": {"id": id}} for id in ids]
+        return 200, self.page(params, items, f"playlists/{playlist_id}/tracks")
+
+    def saved_tracks(self, params, body):
+        offset = int(params.get("offset", ["0"])[0])
+        limit = int(params.get("limit", ["20"])[0])
+        items = [
+            {"track": self.track(f"liked artist {i}", f"liked song {i}")}
+            for i in range(offset, min(offset + limit, self.liked))
+        ]
+        return 200, {"items": items, "total": self.liked, "next": None}
+
+    def page(self, params, items, path):
+        offset = int(params.get("offset", ["0"])[0])
+        limit = int(params.get("limit", ["100"])[0])
+        end = offset + limit
+        next_url = None
+        if end < len(items):
+            next_url = f"{self.prefix}{path}?offset={end}&limit={limit}"
+        return {"items": items[offset:end], "total": len(items), "next": next_url}
+
+
+ROUTES = [
+    ("GET", re.compile(r"/v1/search$"), "search"),
+    ("GET", re.compile(r"/v1/me/?$"), "me"),
+    ("GET", re.compile(r"/v1/me/tracks$"), "saved_tracks"),
+    ("POST", re.compile(r"/v1/users/([^/]+)/playlists$"), "create_playlist"),
+    ("POST", re.compile(r"/v1/playlists/([^/]+)/tracks$"), "add_items"),
+    ("DELETE", re.compile(r"/v1/playlists/([^/]+)/tracks$"), "remove_items"),
+    ("GET", re.compile(r"/v1/playlists/([^/]+)/tracks$"), "playlist_items"),
+]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes, don't let nagle hold them up
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        for route_method, pattern, name in ROUTES:
+            if method == route_method and (match := pattern.match(url.path)):
+                break
+        else:
+            return self.respond(404, {"error": {"status": 404, "message": "not found"}})
+
+        time.sleep(server.latency)
+        with server.lock:
+            server.calls[name] += 1
+            throttled = server.rng.random() < server.throttle
+            server.throttled += throttled
+        if throttled:
+            error = {"error": {"status": 429, "message": "API rate limit exceeded"}}
+            return self.respond(429, error, {"Retry-After": str(RETRY_AFTER)})
+
+        status, response = getattr(server, name)(params, body, *match.groups())
+        with server.lock:
+            failures = server.failures.get(name)
+            failure = failures.pop(0) if failures else None
+        if failure:
+            error = {"error": {"status": failure, "message": "injected failure"}}
+            return self.respond(failure, error)
+        self.respond(status, response)
+
+    def respond(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # keep the benchmark output clean
@@ -0,0 +1,235 @@
+"""
+End to end benchmark of the spotiply and tag_utils pipelines, on a synthetic
+mp3 library and rekordbox export, against a local fake spotify api (see
+fake_spotify) with configurable latency and 429s.
+
+Reports the wall time, throughput, api calls and peak (python) memory of each
+stage as json, to compare across versions.
+
+    python -m benchmarks.run --files 2000 --rb-tracks 20000 --latency 0.02 \\
+        --throttle 0.01 --out bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from mltk.rekordbox import iter_rekordbox
+from mltk.spotiply import (
+    SEARCH_TIERS,
+    SEARCH_WORKERS,
+    create_spotify_playlist,
+    get_liked_songs,
+    get_spotify_track_id,
+    music_dir_to_json,
+    rbox_to_json,
+    sync_spotify_playlist,
+)
+from mltk.scanner import SCAN_WORKERS
+from .fake_spotify import FakeSpotify
+from .synth import fake_songs, make_genre_data, make_mp3_library, make_rekordbox_xml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Stage:
+    """Times one stage, and measures its api calls and peak memory"""
+
+    def __init__(self, server, trace_memory=True):
+        self.server = server
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, name, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs), which returns the number of items (files,
+        songs, tracks) it processed, and record how it went under name.
+        """
+        before = self.server.stats()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+
+        n_items = func(*args, **kwargs)
+
+        secs = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        tracemalloc.stop()
+        after = self.server.stats()
+
+        calls = Counter(after["calls"])
+        calls.subtract(before["calls"])
+        self.results[name] = {
+            "seconds": round(secs, 3),
+            "items": n_items,
+            "items_per_second": round(n_items / secs, 1) if secs else None,
+            "api_calls": sum(calls.values()),
+            "api_calls_by_endpoint": {k: v for k, v in calls.items() if v},
+            "throttled": after["throttled"] - before["throttled"],
+            "peak_memory_mb": round(peak / 2**20, 2) if peak is not None else None,
+        }
+        print(f"{name:<20}{secs:>9.2f}s{n_items:>9} items", file=sys.stderr)
+
+
+def spotiply_stages(stage, sp, args, music_dir, xml_file):
+    found = {}
+
+    def scan():
+        return music_dir_to_json(music_dir, "data/songs.sqlite", recursive=True)
+
+    def search():
+        songs = get_spotify_track_id(
+            sp, "data/songs.sqlite", workers=args.workers, tiers=args.tiers
+        )
+        # read back from the store as a stream, counted in one pass
+        n_songs = 0
+        found["n"] = 0
+        for song in songs:
+            n_songs += 1
+            found["n"] += "spotify" in song
+        return n_songs
+
+    def create():
+        found["playlist"] = create_spotify_playlist(sp, "bench", "data/songs.sqlite")
+        return found["n"]
+
+    def sync():
+        sync_spotify_playlist(sp, found["playlist"], "data/songs.sqlite")
+        return found["n"]
+
+    def rekordbox_import():
+        return rbox_to_json(xml_file, "data/rekordbox.json")
+
+    def rekordbox_search():
+        # streamed straight from the xml into the search, like -rb
+        songs = get_spotify_track_id(
+            sp,
+            "data/rekordbox.sqlite",
+            workers=args.workers,
+            tiers=args.tiers,
+            songs=iter_rekordbox(xml_file),
+        )
+        return sum(1 for _ in songs)
+
+    def liked_songs():
+        get_liked_songs(sp, "data/liked_songs.csv", workers=args.prefetch)
+        return args.liked
+
+    stage.run("scan", scan)
+    stage.run("search", search)
+    stage.run("create_playlist", create)
+    stage.run("sync_playlist", sync)
+    stage.run("rekordbox_import", rekordbox_import)
+    stage.run("rekordbox_search", rekordbox_search)
+    stage.run("liked_songs", liked_songs)
+
+
+def tag_utils_stages(stage, args, music_dir):
+    # imported here, genres finds its data folder from the working directory
+    from mltk.genres import clean_tags
+
+    def clean_genres():
+        return sum(clean_tags(music_dir, workers=args.scan_workers).values())
+
+    def plan_artist_genres():
+        counts = clean_tags(
+            music_dir,
+            use_artist_genre=True,
+            workers=args.scan_workers,
+            plan_file="data/plan.jsonl",
+        )
+        return sum(counts.values())
+
+    stage.run("clean_genres", clean_genres)
+    stage.run("plan_artist_genres", plan_artist_genres)
+
+
+def version():
+    try:
+        out = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=500, help="mp3s in the library")
+    parser.add_argument("--rb-tracks", type=int, default=5000, help="in the xml")
+    parser.add_argument("--liked", type=int, default=1000, help="liked songs")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds")
+    parser.add_argument("--throttle", type=float, default=0.0, help="429 fraction")
+    parser.add_argument("--miss-rate", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=SEARCH_WORKERS)
+    parser.add_argument("--scan-workers", type=int, default=SCAN_WORKERS)
+    parser.add_argument("--prefetch", type=int, default=4)
+    parser.add_argument("--tiers", nargs="+", default=SEARCH_TIERS)
+    parser.add_argument("--pipelines", nargs="+", default=["spotiply", "tag_utils"])
+    parser.add_argument("--no-trace-memory", action="store_true")
+    parser.add_argument("--out", help="json file to write, default is stdout")
+    args = parser.parse_args()
+
+    report = {
+        "version": version(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "stages": {},
+    }
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # the pipelines write to data/ relative to the working directory
+        os.chdir(tmp)
+        try:
+            music_dir = os.path.join(tmp, "music")
+            xml_file = os.path.join(tmp, "collection.xml")
+            make_mp3_library(music_dir, args.files, subdirs=max(1, args.files // 200))
+            make_rekordbox_xml(xml_file, args.rb_tracks)
+            make_genre_data("data", fake_songs(args.files))
+
+            server = FakeSpotify(
+                latency=args.latency,
+                throttle=args.throttle,
+                miss_rate=args.miss_rate,
+                liked=args.liked,
+            )
+            with server:
+                stage = Stage(server, trace_memory=not args.no_trace_memory)
+                if "spotiply" in args.pipelines:
+                    spotiply_stages(stage, server.client(), args, music_dir, xml_file)
+                if "tag_utils" in args.pipelines:
+                    tag_utils_stages(stage, args, music_dir)
+                report["stages"] = stage.results
+        finally:
+            os.chdir(cwd)
+
+    # peak resident memory of the whole run, including worker processes
+    report["max_rss_mb"] = {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1
+        ),
+    }
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Synthetic test data for the benchmarks"""
+
+import eyed3
+import json
+import logging
+import os
+import random
+from eyed3.id3 import ID3_V2_3, ID3_V2_4, Tag
+from xml.sax.saxutils import quoteattr
+
+# constants
+GENRES = ["House", "Deep House", "Techno", "Trance", "Hip Hop", "Pop", "Disco", "Drum and Bass"]
+WORDS = ["love", "night", "fire", "dance", "city", "dream", "heart", "light", "golden", "wild"]
+MPEG_FRAME = b"\xff\xfb\x90\x00" + bytes(413)  # 128kbps 44.1kHz frame of silence
+
+# stubs aren't real mp3s, keep eyed3 quiet about it
+logging.getLogger("eyed3").setLevel(logging.ERROR)
+
+
+def fake_song(i, rng=random):
+    artist = f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i % 500}"
+    title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+    return {"artist": artist, "title": f"{title} {i}", "genre": rng.choice(GENRES)}
+
+
+def make_mp3_library(path, n_files, audio_frames=16, subdirs=1, seed=0):
+    """
+    Write n_files stub mp3s to path, spread over `subdirs` sub directories.
+    Each has an ID3 tag (a mix of v2.3 and v2.4) and `audio_frames` silent MPEG frames.
+    Returns the list of file paths.
+    """
+    rng = random.Random(seed)
+    files = []
+    for i in range(n_files):
+        folder = os.path.join(path, f"{i % subdirs:03d}") if subdirs > 1 else path
+        os.makedirs(folder, exist_ok=True)
+        file = os.path.join(folder, f"{i:06d}.mp3")
+        with open(file, "wb") as f:
+            f.write(MPEG_FRAME * audio_frames)
+
+        song = fake_song(i, rng)
+        tag = Tag()
+        tag.artist = song["artist"]
+        tag.album_artist = song["artist"]
+        tag.title = song["title"]
+        tag.genre = song["genre"]
+        tag.album = f"Album {i // 10}"
+        tag.save(file, version=ID3_V2_4 if i % 2 else ID3_V2_3)
+        files.append(file)
+
+    return files
+
+
+def fake_songs(n_songs, seed=0):
+    """The songs make_mp3_library tags its files with, for the same seed"""
+    rng = random.Random(seed)
+    return [fake_song(i, rng) for i in range(n_songs)]
+
+
+def make_rekordbox_xml(file, n_tracks, seed=0):
+    """
+    Write a rekordbox collection xml export of n_tracks, every fifth with a
+    second artist, and a playlist of the first ten.
+    """
+    rng = random.Random(seed)
+    with open(file, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<DJ_PLAYLISTS Version="1.0.0">\n')
+        f.write(f'<COLLECTION Entries="{n_tracks}">\n')
+        for i in range(n_tracks):
+            song = fake_song(i, rng)
+            artist = song["artist"] + (f", Guest {i}" if i % 5 == 0 else "")
+            f.write(
+                f'<TRACK TrackID="{i}" Name={quoteattr(song["title"])}'
+                f' Artist={quoteattr(artist)} Genre={quoteattr(song["genre"])}'
+                f' TotalTime="{rng.randint(150, 420)}">'
+                '<TEMPO Inizio="0.0" Bpm="124.00" Metro="4/4" Battito="1"/></TRACK>\n'
+            )
+        f.write("</COLLECTION>\n<PLAYLISTS>\n")
+        f.write('<NODE Type="0" Name="ROOT" Count="1">\n')
+        f.write(f'<NODE Name="bench" Type="1" Entries="{min(n_tracks, 10)}">')
+        f.write("".join(f'<TRACK Key="{i}"/>' for i in range(min(n_tracks, 10))))
+        f.write("</NODE>\n</NODE>\n</PLAYLISTS>\n</DJ_PLAYLISTS>\n")
+
+
+def make_rekordbox_txt(file, n_tracks, seed=0):
+    """Write a rekordbox playlist txt export (utf16, tab separated) of n_tracks"""
+    rng = random.Random(seed)
+    with open(file, "w", encoding="utf-16", newline="") as f:
+        f.write("#\tArtist\tTrack Title\tGenre\tTime\n")
+        for i in range(n_tracks):
+            song = fake_song(i, rng)
+            secs = rng.randint(150, 420)
+            f.write(
+                f"{i + 1}\t{song['artist']}\t{song['title']}\t{song['genre']}"
+                f"\t{secs // 60:02d}:{secs % 60:02d}\n"
+            )
+
+
+def make_genre_data(data_dir, songs):
+    """
+    Write a genres.json mapping the synthetic genres (and some variants) and an
+    artist_genres.csv for the artists of songs, for the tag_utils benchmarks.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    genres = {}
+    for genre in GENRES:
+        genres[genre.lower()] = genre.lower()
+        genres[f"{genre.lower()} music"] = genre.lower()
+    with open(os.path.join(data_dir, "genres.json"), "w", encoding="utf-8") as f:
+        json.dump(genres, f, indent=4)
+
+    rng = random.Random(0)
+    artists = dict.fromkeys(song["artist"] for song in songs)
+    with open(os.path.join(data_dir, "artist_genres.csv"), "w", encoding="utf-8") as f:
+        f.write("artist_id|artist|genres\n")
+        for i, artist in enumerate(artists):
+            artist_genres = rng.sample([g.lower() for g in GENRES], 3)
+            f.write(f"{i}|{artist}|{artist_genres}\n")
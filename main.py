@@ -11,20 +11,16 @@ from pathlib import Path
 from uuid import uuid4
 
 # my modules
-from mltk.genres import clean_tags, scrape_genres
-from mltk.spotiply import (
-    get_liked_songs,
-    get_playlist_items,
-    create_spotify_playlist,
-    generate_credentials_json,
-    spotify_connect,
-    get_spotify_track_id,
-    music_dir_to_json,
-    rbox_to_json,
-)
+# the commands' modules are imported by the commands that use them, so --help
+# and each command only load what they need
+from mltk.metrics import PROFILERS, metrics, profile
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 DATA_DIR = os.path.join(THIS_DIR, "data/")
+SONGS_FORMATS = {"sqlite": ".sqlite", "json": ".json"}  # -> file extension
+SONGS_FORMAT = "sqlite"
+METRICS_JSON = os.path.join(DATA_DIR, "metrics.json")
+PROFILE_FILES = {"cprofile": "profile.prof", "pyinstrument": "profile.html"}
 
 
 def configure_logger(log_to_screen=False):
@@ -65,6 +61,7 @@ def configure_logger(log_to_screen=False):
     loggers = [
         "mltk.spotiply",
         "mltk.genres",
+        "mltk.metrics",
     ]
     for logger_name in loggers:
         _logger = logging.getLogger(logger_name)
@@ -80,7 +77,32 @@ def configure_logger(log_to_screen=False):
 
 
 def parse_args():
+    # only for the defaults, the slow libraries these use are loaded on first use
+    from mltk.scanner import SCAN_WORKERS
+    from mltk.spotiply import (
+        EXPORT_FORMAT,
+        EXPORT_FORMATS,
+        PREFETCH_WORKERS,
+        QUERY_TIERS,
+        SEARCH_TIERS,
+        SEARCH_WORKERS,
+    )
+
     parser = argparse.ArgumentParser(description="Music Library Toolkit")
+    parser.add_argument(
+        "--metrics",
+        nargs="?",
+        const=METRICS_JSON,
+        metavar="FILE",
+        help="Time tag parsing, genre mapping, spotify calls and file writes, "
+        f"and write a summary of the run to FILE (default {METRICS_JSON})",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILERS,
+        help="Profile the run, writing the cProfile stats or pyinstrument html "
+        "report to the data folder",
+    )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     spotiply = subparsers.add_parser(
@@ -98,13 +120,13 @@ def parse_args():
         "-j",
         dest="use_json",
         metavar="JSON_FILE",
-        help="Create spotify playlist using the json_file passed, instead of a music directory.",
+        help="Create spotify playlist using the json file (or .sqlite song store) passed, instead of a music directory.",
     )
     group1.add_argument(
         "-rb",
         dest="use_rb",
-        metavar="REKORDBOX_TXT",
-        help="Create spotify playlist using the rekordbox playlist file REKORDBOX_TXT instead of a music directory.",
+        metavar="REKORDBOX_FILE",
+        help="Create spotify playlist using a rekordbox playlist .txt export or collection .xml export instead of a music directory.",
     )
     group1.add_argument(
         "-c",
@@ -123,6 +145,25 @@ def parse_args():
         metavar="PLAYLIST_URL",
         help="Generate txt file of the songs from the given spotify playlist PLAYLIST_URL",
     )
+    group1.add_argument(
+        "--convert",
+        nargs=2,
+        metavar=("IN_FILE", "OUT_FILE"),
+        help="Convert a json songs file to a .sqlite song store, or the other way round.",
+    )
+    spotiply.add_argument(
+        "-f",
+        "--format",
+        choices=EXPORT_FORMATS,
+        default=EXPORT_FORMAT,
+        help=f"File format for --liked-songs and --playlist-songs, csv is tab delimited. Default is {EXPORT_FORMAT}.",
+    )
+    spotiply.add_argument(
+        "--prefetch",
+        type=int,
+        default=PREFETCH_WORKERS,
+        help=f"Number of pages fetched at a time for --liked-songs and --playlist-songs. Default is {PREFETCH_WORKERS}.",
+    )
     group2 = spotiply.add_argument_group("To be used with --create-playlist")
     group2.add_argument(
         "-dp",
@@ -136,6 +177,52 @@ def parse_args():
         type=str,
         help="Name of the playlist you want to create. If not provided will use a uuid.",
     )
+    group2.add_argument(
+        "--sync",
+        metavar="PLAYLIST_URL",
+        help="Instead of creating a new playlist, update PLAYLIST_URL to match the songs, only adding and removing what changed.",
+    )
+    group2.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        help="Include the mp3 files in the subdirectories of MUSIC_DIR.",
+    )
+    group2.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Read the tags of every mp3, instead of only those changed since the last scan.",
+    )
+    group2.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=SEARCH_WORKERS,
+        help=f"Number of spotify searches to run concurrently. Default is {SEARCH_WORKERS}.",
+    )
+    group2.add_argument(
+        "--tiers",
+        nargs="+",
+        choices=QUERY_TIERS,
+        default=SEARCH_TIERS,
+        help=f"Search queries to try in order, each only for songs the previous ones missed. Default is {' '.join(SEARCH_TIERS)}.",
+    )
+    group2.add_argument(
+        "--songs-format",
+        choices=SONGS_FORMATS,
+        default=SONGS_FORMAT,
+        help=f"Format of the songs file written to the data folder. Default is {SONGS_FORMAT}.",
+    )
+    group2.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Search spotify for every song, ignoring previously cached search results.",
+    )
+    group2.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run, only searching the songs in the json file that weren't found yet.",
+    )
 
     tag_utils = subparsers.add_parser("tag_utils", help="Utilities to clean mp3 tags")
     group3 = tag_utils.add_mutually_exclusive_group(required=True)
@@ -152,56 +239,161 @@ def parse_args():
         metavar="MUSIC_DIR",
         help="Clean the genres and other tag information (using artist to determine the genre) for the mp3 files in MUSIC_DIR.",
     )
+    group3.add_argument(
+        "--apply",
+        dest="apply_plan",
+        metavar="PLAN_FILE",
+        help="Save the tag changes in PLAN_FILE, as planned by -g/-ga with --plan.",
+    )
     group3.add_argument(
         "-ug",
         dest="update_genres",
         action="store_true",
         help="Updates the genre mapping json.",
     )
+    tag_utils.add_argument(
+        "--plan",
+        dest="plan_file",
+        metavar="PLAN_FILE",
+        help="With -g/-ga, don't change any files, just write the planned tag changes to PLAN_FILE (jsonl).",
+    )
+    tag_utils.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=SCAN_WORKERS,
+        help=f"Number of processes cleaning files at a time. Default is {SCAN_WORKERS}.",
+    )
+    tag_utils.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Clean every mp3, instead of only those changed since they were last cleaned.",
+    )
 
     return parser.parse_args()
 
 
-if __name__ == "__main__":
-    args = parse_args()
-    logger = configure_logger(log_to_screen=True)
-
-    # create data dir if doesnt exist
-    Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
-
+def run(args):
+    """Run the command in args"""
     if args.command == "spotiply":
-        sp = spotify_connect()
+        from mltk.cache import SEARCH_CACHE
+        from mltk.library import LIBRARY_INDEX
+        from mltk.rekordbox import iter_rekordbox
+        from mltk.songstore import convert_songs
+        from mltk.spotiply import (
+            LazySpotify,
+            create_spotify_playlist,
+            generate_credentials_json,
+            get_liked_songs,
+            get_playlist_items,
+            get_spotify_track_id,
+            scan_songs,
+            sync_spotify_playlist,
+        )
+
+        # only connects to spotify once a command makes a spotify call
+        sp = LazySpotify()
 
         if args.credentials:
             generate_credentials_json()
 
         elif args.liked_songs:
-            get_liked_songs(sp)
+            get_liked_songs(sp, fmt=args.format, workers=args.prefetch)
 
         elif args.playlist_songs:
-            get_playlist_items(sp, args.playlist_songs)
+            get_playlist_items(
+                sp, args.playlist_songs, fmt=args.format, workers=args.prefetch
+            )
 
-        elif args.create_playlist or args.use_json or args.use_rb:
-            playlist_name = args.playlist_name if args.playlist_name else uuid4().hex
-            json_file = os.path.join(DATA_DIR, playlist_name + ".json")
+        elif args.convert:
+            convert_songs(*args.convert)
 
+        elif args.create_playlist or args.use_json or args.use_rb:
+            songs = None
             if args.use_json:
                 playlist_name = Path(args.use_json).stem
-                create_spotify_playlist(sp, playlist_name, args.use_json)
+                json_file = args.use_json
             else:
-                if args.use_rb:
-                    rbox_to_json(args.use_rb, json_file)
-                else:
-                    music_dir_to_json(args.create_playlist, json_file)
+                playlist_name = args.playlist_name if args.playlist_name else uuid4().hex
+                json_file = os.path.join(
+                    DATA_DIR, playlist_name + SONGS_FORMATS[args.songs_format]
+                )
 
-                get_spotify_track_id(sp, json_file)
-                if not args.disable_playlist:
-                    create_spotify_playlist(sp, playlist_name, json_file)
+                # a resumed run carries on with the json file already exported,
+                # otherwise the songs are streamed into the search, which writes
+                # json_file
+                if not (args.resume and os.path.exists(json_file)):
+                    if args.use_rb:
+                        songs = iter_rekordbox(args.use_rb)
+                    else:
+                        songs = scan_songs(
+                            args.create_playlist,
+                            recursive=args.recursive,
+                            index_file=None if args.no_index else LIBRARY_INDEX,
+                        )
+
+            if not args.use_json or args.resume:
+                songs = get_spotify_track_id(
+                    sp,
+                    json_file,
+                    workers=args.workers,
+                    cache_file=None if args.no_cache else SEARCH_CACHE,
+                    resume=args.resume,
+                    tiers=args.tiers,
+                    songs=songs,
+                )
+            if args.sync:
+                sync_spotify_playlist(sp, args.sync, json_file, songs=songs)
+            elif not args.disable_playlist:
+                create_spotify_playlist(sp, playlist_name, json_file, songs=songs)
 
     elif args.command == "tag_utils":
+        from mltk.genres import apply_tag_plan, clean_tags, scrape_genres
+        from mltk.library import LIBRARY_INDEX, LibraryIndex
+
+        index_file = None if args.no_index else LIBRARY_INDEX
+
         if args.clean_genres:
-            clean_tags(args.clean_genres)
+            clean_tags(
+                args.clean_genres,
+                index_file=index_file,
+                workers=args.workers,
+                plan_file=args.plan_file,
+            )
         elif args.clean_genres2:
-            clean_tags(args.clean_genres2, use_artist_genre=True)
+            clean_tags(
+                args.clean_genres2,
+                use_artist_genre=True,
+                index_file=index_file,
+                workers=args.workers,
+                plan_file=args.plan_file,
+            )
+        elif args.apply_plan:
+            apply_tag_plan(args.apply_plan, workers=args.workers, index_file=index_file)
         elif args.update_genres:
             scrape_genres()
+            # the new mapping may change genres of files that were already cleaned
+            with LibraryIndex() as index:
+                index.reset_cleaned()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logger = configure_logger(log_to_screen=True)
+
+    # create data dir if doesnt exist
+    Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
+
+    if args.metrics:
+        metrics.enable()
+    try:
+        if args.profile:
+            profile_file = os.path.join(DATA_DIR, PROFILE_FILES[args.profile])
+            with profile(args.profile, profile_file):
+                run(args)
+        else:
+            run(args)
+    finally:
+        # written even when the run fails or is interrupted
+        if args.metrics:
+            metrics.write_summary(args.metrics)
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# constants
+SEARCH_CACHE = os.path.join("data", "search_cache.sqlite")
+MISS_TTL = 7 * 24 * 60 * 60  # seconds before a song that wasn't found is searched again
+MAX_ENTRIES = 100000
+
+# initialise logging
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    """
+    On-disk cache of spotify search results, keyed on the cleaned artist and title.
+
+    Both hits and misses are stored. Misses are stored with the search tiers
+    that missed, and expire after `miss_ttl` seconds. Once there are more than
+    `max_entries` rows the least recently used are evicted.
+    Safe to share between the threads of get_spotify_track_id.
+    """
+
+    def __init__(self, db_file=SEARCH_CACHE, miss_ttl=MISS_TTL, max_entries=MAX_ENTRIES):
+        Path(db_file).parent.mkdir(parents=True, exist_ok=True)
+        self.db_file = db_file
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(db_file, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS searches (
+                artist TEXT NOT NULL,
+                title TEXT NOT NULL,
+                result TEXT,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                tiers TEXT,
+                PRIMARY KEY (artist, title)
+            )
+            """
+        )
+        # caches made before misses recorded their tiers
+        columns = [row[1] for row in self._con.execute("PRAGMA table_info(searches)")]
+        if "tiers" not in columns:
+            self._con.execute("ALTER TABLE searches ADD COLUMN tiers TEXT")
+        self._con.execute(
+            "CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used)"
+        )
+        self._con.commit()
+
+    def get(self, artist, title, tiers=None):
+        """
+        Look up a cleaned artist/title pair.
+        Returns (True, result) on a cache hit, where result is None for a cached
+        miss, and (False, None) when spotify needs to be searched.
+        With tiers, a cached miss only counts if it missed with all of them.
+        """
+        key = (artist or "", title or "")
+        now = time.time()
+        with self._lock:
+            row = self._con.execute(
+                "SELECT result, created, tiers FROM searches "
+                "WHERE artist = ? AND title = ?",
+                key,
+            ).fetchone()
+
+            if row is None or (
+                row[0] is None
+                and (now - row[1] > self.miss_ttl or not _tried(tiers, row[2]))
+            ):
+                self.misses += 1
+                return False, None
+
+            self._con.execute(
+                "UPDATE searches SET last_used = ? WHERE artist = ? AND title = ?",
+                (now, *key),
+            )
+            self._con.commit()
+            self.hits += 1
+            return True, json.loads(row[0]) if row[0] is not None else None
+
+    def put(self, artist, title, result, tiers=None):
+        """
+        Store the search result for a cleaned artist/title pair (None for a
+        miss, along with the tiers that missed)
+        """
+        now = time.time()
+        with self._lock:
+            self._con.execute(
+                "INSERT OR REPLACE INTO searches "
+                "(artist, title, result, created, last_used, tiers) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    artist or "",
+                    title or "",
+                    json.dumps(result) if result is not None else None,
+                    now,
+                    now,
+                    json.dumps(list(tiers)) if tiers and result is None else None,
+                ),
+            )
+            self._con.commit()
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_entries"""
+        with self._lock:
+            cur = self._con.execute(
+                """
+                DELETE FROM searches WHERE rowid IN (
+                    SELECT rowid FROM searches ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._con.commit()
+        if cur.rowcount > 0:
+            logger.info(f"Evicted {cur.rowcount} entries from {self.db_file}")
+
+    def close(self):
+        self.evict()
+        self._con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _tried(tiers, tried):
+    """Whether the tiers of a search were all tried by a cached miss"""
+    if not tiers:
+        return True
+    return tried is not None and set(tiers) <= set(json.loads(tried))
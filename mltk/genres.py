@@ -1,18 +1,24 @@
+import ast
 import csv
 
 import os
 import eyed3
 import json
-import requests
+import numpy as np
 import time
 import logging
-import unicodedata
-from bs4 import BeautifulSoup
-from pathlib import Path
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from tqdm import tqdm
-from fuzzywuzzy import process
-from .spotiply import spotify_connect
-from .utils import clean_artist, clean_song_title, most_frequent
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+from .library import INDEX_FRAMES, LibraryIndex
+from .metrics import metrics
+from .scanner import list_mp3s, scan_tags
+from .ratelimit import TokenBucket, call_with_backoff
+from .normalize import clean_artist, clean_artists, remove_accents
+from .utils import batched, weighted_vote
 
 URL = "https://www.chosic.com/list-of-music-genres/"
 HEADERS = {
@@ -23,12 +29,29 @@ GENRE_LOG_FILE = os.path.join(DATA_FOLDER, ".genre_log")
 GENRES_JSON = os.path.join(DATA_FOLDER, "genres.json")
 ARTIST_GENRES_CSV = os.path.join(DATA_FOLDER, "artist_genres.csv")
 SONG_ARCHIVE = "/home/nickneos/Downloads/zspotify/ZSpotify Music/.song_archive"
+GENRE_SCORE_CUTOFF = 87
+GENRE_FUZZY_LIMIT = 5
+GENRE_CACHE_SIZE = 4096
+ARTIST_SCORE_CUTOFF = 91
+ARTIST_CACHE_SIZE = 16384
+CDIST_CHUNK = 256  # rows of the fuzzy score matrix computed at a time
+SPOTIFY_BATCH_SIZE = 50  # the most tracks or artists spotify will look up at a time
+CLEAN_CHUNKSIZE = 16  # files handed to a clean_tags worker process at a time
 
 # initialise logging
 logger = logging.getLogger(__name__)
 
+# clean_tag options of a clean_tags worker, and whether it's a worker process
+# handing back its metrics, set by _init_tag_worker
+_clean_options = {}
+_worker_metrics = False
+
 
 def scrape_genres(out_file=GENRES_JSON):
+    # only needed here, so not loaded for every other command
+    import requests
+    from bs4 import BeautifulSoup
+
     headers = requests.utils.default_headers()
     headers.update(HEADERS)
     page = requests.get(URL, headers=headers)
@@ -91,113 +114,347 @@ def scrape_genres(out_file=GENRES_JSON):
         json.dump(genre_dict, fp, indent=2)
 
     logger.info(f"Scraped genres to {out_file}")
+    genre_mapper.cache_clear()
+    artist_genre_mapper.cache_clear()
 
     return genre_dict
 
 
 def clean_tag(
     audio,
-    debug=False,
     use_artist_genre=False,
     update_year=True,
     update_genre=True,
     clean_accents=True,
+    genre_map=None,
+    dry_run=False,
 ):
-    audio = eyed3.load(audio)
-    tag_changed = False
-    
+    """
+    Clean the tags of an mp3.
+    Returns a dict of the path, status ("changed" or "unchanged"), the changes
+    as {field: [old, new]} and whether saving them means rewriting the whole
+    file. With dry_run the changes are worked out but not saved.
+    """
+    with metrics.timer("eyed3.load"):
+        audio = eyed3.load(audio)
+    tag = audio.tag
+    changes = {}
+
     ### update year
-    if not debug and update_year:
-        if audio.tag.recording_date != audio.tag.original_release_date:
-            audio.tag.recording_date = audio.tag.original_release_date
-            tag_changed = True
+    if update_year and tag.original_release_date:
+        if tag.recording_date != tag.original_release_date:
+            changes["recording_date"] = [
+                _tag_value(tag, "recording_date"),
+                str(tag.original_release_date),
+            ]
 
     ### remove accents
-    if not debug and clean_accents:
-        try:
-            artist_clean = remove_accents(audio.tag.artist)
-            if audio.tag.artist != artist_clean:
-                audio.tag.artist = artist_clean
-                tag_changed = True
-        except:
-            pass
-
-        try:
-            albumartist_clean = remove_accents(audio.tag.album_artist)
-            if audio.tag.album_artist != albumartist_clean:
-                audio.tag.album_artist = albumartist_clean
-                tag_changed = True
-        except:
-            pass
-
-        try:
-            title_clean = remove_accents(audio.tag.title)
-            if audio.tag.title != title_clean:
-                audio.tag.title = title_clean
-                tag_changed = True
-        except:
-            pass
+    if clean_accents:
+        for field in ["artist", "album_artist", "title"]:
+            value = getattr(tag, field)
+            if value and value != (value_clean := remove_accents(value)):
+                changes[field] = [value, value_clean]
 
     ### update genre
-    if audio.tag.genre:
-        og_genre = audio.tag.genre.name
-
-        # get mapped genre
-        if use_artist_genre:
-            update_to = map_artist_genre(clean_artist(audio.tag.artist))
+    if update_genre and tag.genre:
+        og_genre = tag.genre.name
+        artist = changes["artist"][1] if "artist" in changes else tag.artist
+
+        # get mapped genre, from the pre-resolved genre_map if its there
+        key = clean_artist(artist) if use_artist_genre else og_genre
+        if genre_map is not None and key in genre_map:
+            update_to = genre_map[key]
+        elif use_artist_genre:
+            update_to = map_artist_genre(key)
         else:
             update_to = map_genre(og_genre)
 
-        # print debug info
-        if debug:
-            print("\n" + Path(audio.path).name)
-            print(og_genre, "->", update_to)
-
-        # update actual genre tag
-        elif update_genre and update_to.lower() != og_genre.lower():
+        if update_to and update_to.lower() != og_genre.lower():
+            changes["genre"] = [og_genre, update_to]
             #  copy original genre to comments
-            if not debug and audio.tag.comments.get("genre") is None:
-                audio.tag.comments.set(f"{og_genre}", "genre")
+            if tag.comments.get("genre") is None:
+                changes["genre_comment"] = [None, og_genre]
 
-            # actually update the genre tag
-            audio.tag.genre = update_to
-            tag_changed = True
+    result = {
+        "path": str(audio.path),
+        "status": "changed" if changes else "unchanged",
+        "changes": changes,
+        "rewrite": False,
+    }
 
     ### save tag
-    if tag_changed:
-        try:
+    if changes:
+        _set_tag_values(tag, changes)
+        result["rewrite"] = _needs_rewrite(tag)
+        if not dry_run:
+            with metrics.timer("eyed3.save"):
+                tag.save(preserve_file_time=True)
+            logger.info(f"Saved tag: {audio}")
+
+    return result
+
+
+def apply_tag_changes(plan):
+    """
+    Save the changes planned by clean_tag(..., dry_run=True).
+    Fields that no longer hold the planned old value (eg retagged since the
+    plan was made) are left alone, so only real changes are written.
+    Returns a dict like clean_tag.
+    """
+    with metrics.timer("eyed3.load"):
+        audio = eyed3.load(plan["path"])
+    changes = {
+        field: [old, new]
+        for field, (old, new) in plan["changes"].items()
+        if _tag_value(audio.tag, field) == old
+    }
+    result = {
+        "path": plan["path"],
+        "status": "changed" if changes else "unchanged",
+        "changes": changes,
+        "rewrite": False,
+    }
+
+    if changes:
+        _set_tag_values(audio.tag, changes)
+        result["rewrite"] = _needs_rewrite(audio.tag)
+        with metrics.timer("eyed3.save"):
             audio.tag.save(preserve_file_time=True)
-        except:
-            logger.warning(f"Issue saving tag...skipping: {audio.path}")
         logger.info(f"Saved tag: {audio}")
 
+    return result
+
+
+def _tag_value(tag, field):
+    """A tag field's value as saved in a plan"""
+    if field == "genre_comment":
+        comment = tag.comments.get("genre")
+        return comment.text if comment else None
+    value = getattr(tag, field)
+    if field == "genre":
+        return value.name if value else None
+    if field == "recording_date":
+        return str(value) if value else None
+    return value
 
-def clean_tags(path, debug=False, use_artist_genre=False, log_file=GENRE_LOG_FILE):
-    paths = [x for x in Path(path).rglob("*.mp3")]
-    if not debug:
-        paths = tqdm(paths)
 
-    for audio in paths:
-        # update genre tag
-        try:
-            # before, after =
-            clean_tag(audio, debug, use_artist_genre)
-        except:
-            continue
+def _set_tag_values(tag, changes):
+    for field, (_, new) in changes.items():
+        if field == "genre_comment":
+            tag.comments.set(new, "genre")
+        else:
+            setattr(tag, field, new)
+
 
-        # # log genre change
-        # if not debug and after:
-        #     if after.lower().strip() != before.lower().strip():
-        #         with open(log_file, "a", encoding="utf-8") as f:
-        #             csv_writer = csv.writer(f, delimiter="\t")
-        #             csv_writer.writerow([audio, before, after])
+def _needs_rewrite(tag):
+    """
+    Whether saving the tag means rewriting the whole mp3, because the new tag
+    doesn't fit in the space (including padding) of the current one.
+    """
+    if tag.version[0] != 2 or tag.file_info is None:
+        return False
+    # eyed3 doesn't expose this, so ask its renderer the same way Tag.save does
+    rewrite, _, _ = tag._render(tag.version, tag.file_info.tag_size, None)
+    return rewrite
+
+
+def clean_tags(
+    path,
+    use_artist_genre=False,
+    log_file=GENRE_LOG_FILE,
+    index_file=None,
+    workers=1,
+    plan_file=None,
+):
+    """
+    Clean the tags of the mp3s in path.
+    With plan_file nothing is saved; the planned changes are written to
+    plan_file as jsonl instead, to be reviewed and saved by apply_tag_plan.
+    """
+    mode = "artist_genre" if use_artist_genre else "genre"
+    index = LibraryIndex(index_file) if index_file else None
+
+    # first pass: read the genre and artist of each file.
+    # with a library index, files already cleaned and unchanged since are skipped
+    if index:
+        songs = [row for row in index.scan(path) if row["cleaned"] != mode]
+    else:
+        mp3s = list_mp3s(path, recursive=True)
+        songs = [
+            {"path": mp3, **tags}
+            for mp3, tags in zip(mp3s, scan_tags(mp3s, INDEX_FRAMES))
+        ]
+
+    # resolve each distinct genre (or artist) once, for all the files
+    genre_map = resolve_genres(songs, use_artist_genre)
+    logger.info(
+        f"Resolved {len(genre_map)} distinct {'artists' if use_artist_genre else 'genres'}"
+        f" for {len(songs)} files"
+    )
+
+    # second pass: update (or plan the update of) the files
+    options = {
+        "use_artist_genre": use_artist_genre,
+        "genre_map": genre_map,
+        "dry_run": plan_file is not None,
+    }
+    paths = [song["path"] for song in songs]
+    counts = Counter()
+    plan = open(plan_file, "w", encoding="utf-8") if plan_file else None
+    try:
+        for result in _run_tag_workers(
+            _clean_tag_worker, paths, workers, options, counts
+        ):
+            if result["status"] == "failed":
+                continue
+            if plan:
+                if result["changes"]:
+                    plan.write(json.dumps(result, ensure_ascii=False) + "\n")
+            elif index:
+                if result["status"] == "changed":
+                    index.update(result["path"])
+                index.mark_cleaned(result["path"], mode)
+    finally:
+        if plan:
+            plan.close()
+            logger.info(f"Saved planned tag changes to {plan_file}")
+        if index:
+            index.close()
+
+    return counts
+
+
+def apply_tag_plan(plan_file, workers=1, index_file=None):
+    """Save the tag changes in plan_file, as written by clean_tags"""
+    with open(plan_file, "r", encoding="utf-8") as f:
+        plans = [json.loads(line) for line in f if line.strip()]
+
+    counts = Counter()
+    index = LibraryIndex(index_file) if index_file else None
+    try:
+        for result in _run_tag_workers(
+            _apply_plan_worker, plans, workers, counts=counts
+        ):
+            if index and result["status"] == "changed":
+                index.update(result["path"])
+    finally:
+        if index:
+            index.close()
+
+    return counts
+
+
+def _run_tag_workers(func, jobs, workers, options=None, counts=None):
+    """
+    Run func over jobs (files or plans), spread across `workers` processes,
+    yielding the results in order. Failures and files needing a full rewrite
+    are logged, followed by a summary of the run, and the statuses are
+    tallied in counts.
+    Options are handed to each worker once, when it starts up.
+    """
+    start = time.perf_counter()
+    counts = Counter() if counts is None else counts
+    executor = None
+    if workers > 1 and len(jobs) > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_tag_worker,
+            initargs=(options, metrics.enabled),
+        )
+        results = executor.map(func, jobs, chunksize=CLEAN_CHUNKSIZE)
+    else:
+        _init_tag_worker(options)
+        results = map(func, jobs)
+
+    try:
+        for result in tqdm(results, total=len(jobs)):
+            # what the worker measured for this job
+            metrics.merge(result.pop("metrics", None))
+            counts[result["status"]] += 1
+            if result["status"] == "failed":
+                logger.error(f"Failed to clean {result['path']}: {result['error']}")
+            elif result["rewrite"]:
+                counts["rewrite"] += 1
+                logger.info(f"Tag doesn't fit its padding, full rewrite: {result['path']}")
+            yield result
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    secs = time.perf_counter() - start
+    dry_run = options and options.get("dry_run")
+    logger.info(
+        f"{counts['changed']} {'to change' if dry_run else 'changed'} "
+        f"({counts['rewrite']} needing a full rewrite), {counts['unchanged']} unchanged, "
+        f"{counts['failed']} failed in {secs:.1f}s ({len(jobs) / max(secs, 1e-9):.0f} files/s)"
+    )
+
+
+def _init_tag_worker(options, metrics_enabled=None):
+    """
+    Set up a tag worker. metrics_enabled is given in worker processes, which
+    then hand back their metrics with each result.
+    """
+    global _clean_options, _worker_metrics
+    _clean_options = options or {}
+    _worker_metrics = metrics_enabled is not None
+    if _worker_metrics:
+        metrics.start_worker(metrics_enabled)
+
+
+def _clean_tag_worker(audio):
+    try:
+        result = clean_tag(audio, **_clean_options)
+    except Exception as e:
+        result = {"path": str(audio), "status": "failed", "error": f"{type(e).__name__} - {e}"}
+    return _with_metrics(result)
+
+
+def _apply_plan_worker(plan):
+    try:
+        result = apply_tag_changes(plan)
+    except Exception as e:
+        result = {"path": plan["path"], "status": "failed", "error": f"{type(e).__name__} - {e}"}
+    return _with_metrics(result)
+
+
+def _with_metrics(result):
+    if _worker_metrics and (taken := metrics.take()):
+        result["metrics"] = taken
+    return result
+
+
+def resolve_genres(songs, use_artist_genre=False):
+    """
+    Map the distinct genres (or cleaned artists) of songs, a list of dicts with
+    "artist" and "genre" keys, in one batch.
+    Returns a dict of genre (or cleaned artist) -> mapped genre.
+    """
+    with metrics.timer("resolve_genres"):
+        if use_artist_genre:
+            # same artist clean_tag will see, after it removes accents
+            artists = clean_artists(
+                remove_accents(s["artist"]) for s in songs if s["genre"] and s["artist"]
+            )
+            return artist_genre_mapper().map_many(artists)
+        else:
+            return genre_mapper().map_many(s["genre"] for s in songs if s["genre"])
 
 
 def get_spotify_genres_from_song_archive(
     archive=SONG_ARCHIVE,
     csv_file=ARTIST_GENRES_CSV,
+    sp=None,
 ):
-    sp = spotify_connect()
+    """
+    Add the spotify genres of the artists of the songs in a zspotify song
+    archive to csv_file, skipping artists already in it.
+    Tracks and artists are looked up SPOTIFY_BATCH_SIZE at a time.
+    """
+    from .spotiply import spotify_connect
+
+    sp = sp or spotify_connect()
+    limiter = TokenBucket()
 
     # create csv if doesnt exist
     if not os.path.exists(csv_file):
@@ -207,76 +464,297 @@ def get_spotify_genres_from_song_archive(
     # get artists already in csv
     with open(csv_file, "r", encoding="utf-8") as f:
         reader = csv.reader(f, delimiter="|")
-        artists_in_csv = [row[1] for row in reader]
+        rows = list(reader)
+        ids_in_csv = {row[0] for row in rows}
+        artists_in_csv = {row[1] for row in rows}
 
-    # open archive
+    # unique track ids in the archive, of artists we don't have yet
     with open(archive, "r", encoding="utf-8") as f:
         logger.info(f"Reading {archive}")
-
-        for line in tqdm(f.readlines()):
-            row = line.split("\t")
-
-            if row[2] not in artists_in_csv:
-                song = sp.track(row[0])
-                artist_id = song["artists"][0]["id"]
-                time.sleep(5)
-
-                a = sp.artist(artist_id)
-                values = [artist_id, a["name"], a["genres"]]
-
-                with open(csv_file, "a", encoding="utf-8") as f:
-                    writer = csv.writer(f, delimiter="|")
-                    writer.writerow(values)
-
-                artists_in_csv.append(a["name"])
+        rows = [line.split("\t") for line in f]
+        track_ids = list(
+            dict.fromkeys(
+                row[0] for row in rows if len(row) > 2 and row[2] not in artists_in_csv
+            )
+        )
+
+    # look up the tracks, for their (first) artist's id
+    artist_ids = {}
+    for batch in tqdm(list(batched(track_ids, SPOTIFY_BATCH_SIZE)), desc="tracks"):
+        for track in call_with_backoff(sp.tracks, batch, limiter=limiter)["tracks"]:
+            if track and track["artists"]:
+                artist_ids[track["artists"][0]["id"]] = None
+    artist_ids = [id for id in artist_ids if id not in ids_in_csv]
+
+    # look up the artists, for their genres
+    new_rows = []
+    for batch in tqdm(list(batched(artist_ids, SPOTIFY_BATCH_SIZE)), desc="artists"):
+        for a in call_with_backoff(sp.artists, batch, limiter=limiter)["artists"]:
+            if a:
+                new_rows.append([a["id"], a["name"], a["genres"]])
+
+    with open(csv_file, "a", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter="|")
+        writer.writerows(new_rows)
+    logger.info(f"Added {len(new_rows)} artists to {csv_file}")
+
+    artist_genre_mapper.cache_clear()
+
+
+class GenreMapper:
+    """
+    Maps genre names to the genres in genres.json.
+
+    The json is loaded once, the genre names are preprocessed once for fuzzy
+    matching, and results are memoized per raw genre string.
+    A fuzzy matched genre is voted on by its closest genre names, weighted by
+    their match scores.
+    """
+
+    def __init__(self, genres_json=GENRES_JSON, cache_size=GENRE_CACHE_SIZE):
+        with open(genres_json, "r", encoding="utf-8") as fp:
+            self.genre_dict = json.load(fp)
+
+        # fuzzy match index: the genre names processed the same way as the
+        # genre being looked up, so each lookup is a single rapidfuzz call
+        self.genres = list(self.genre_dict)
+        self._choices = [default_process(g) for g in self.genres]
+
+        self.vote = lru_cache(maxsize=cache_size)(self._vote)
+        self.map = lru_cache(maxsize=cache_size)(self._map)
+
+    def _map(self, genre):
+        return self.vote(genre)[0]
+
+    def _vote(self, genre):
+        """The mapped genre and its confidence (0-1), or (None, 0.0)"""
+        if not genre:
+            return None, 0.0
+        # exact match
+        if g := self.genre_dict.get(genre.lower().strip()):
+            return g, 1.0
+        # fuzzy match
+        results = process.extract(
+            default_process(genre),
+            self._choices,
+            scorer=fuzz.WRatio,
+            processor=None,
+            score_cutoff=GENRE_SCORE_CUTOFF,
+            limit=GENRE_FUZZY_LIMIT,
+        )
+        return self._vote_matches([(i, score) for _, score, i in results])
+
+    def _vote_matches(self, matches):
+        votes = [(self.genre_dict[self.genres[i]], score) for i, score in matches]
+        return vote_with_scores(votes)
+
+    def map_many(self, genres):
+        """
+        Map many genres at once, fuzzy matching all the ones without an exact
+        match together in batches.
+        Returns a dict of genre -> mapped genre.
+        """
+        return {genre: g for genre, (g, _) in self.vote_many(genres).items()}
+
+    def vote_many(self, genres):
+        """map_many, returning a dict of genre -> (mapped genre, confidence)"""
+        voted = {}
+        fuzzy = []
+        for genre in dict.fromkeys(genres):
+            if g := self.genre_dict.get(genre.lower().strip()):
+                voted[genre] = (g, 1.0)
+            else:
+                fuzzy.append(genre)
+
+        matches = fuzzy_best_matches(
+            fuzzy, self._choices, GENRE_SCORE_CUTOFF, GENRE_FUZZY_LIMIT
+        )
+        for genre, best in zip(fuzzy, matches):
+            voted[genre] = self._vote_matches(best)
+
+        return voted
+
+
+@lru_cache(maxsize=None)
+def genre_mapper(genres_json=GENRES_JSON):
+    """The GenreMapper for genres_json, only loaded the first time its needed"""
+    return GenreMapper(genres_json)
 
 
 def map_genre(genre, genres_json=GENRES_JSON):
-    with open(genres_json, "r", encoding="utf-8") as fp:
-        genre_dict = json.load(fp)
-
-    if genre:
-        # exact match
-        if g := genre_dict.get(genre.lower().strip()):
-            return g
-        # fuzzy match
-        else:
-            genres = [k for k, _ in genre_dict.items()]
-            results = process.extractBests(genre, genres, score_cutoff=87)
-            results = [x[0] for x in results]
-            results = [genre_dict.get(x.lower().strip()) for x in results]
-            return most_frequent(results)
+    with metrics.timer("map_genre"):
+        return genre_mapper(genres_json).map(genre)
+
+
+class ArtistGenreMapper:
+    """
+    Maps artists to a genre, using the spotify genres of the artist in artist_genres.csv.
+
+    The csv is loaded once into a dict of artist name -> genres, with a fuzzy
+    match index over the artist names, and results are memoized per artist.
+    The artist's genre is voted on by its spotify genres, each weighted by how
+    confidently it mapped to a genre in genres.json.
+    """
+
+    def __init__(
+        self,
+        csv_file=ARTIST_GENRES_CSV,
+        genres_json=GENRES_JSON,
+        cache_size=ARTIST_CACHE_SIZE,
+    ):
+        self.genre_mapper = genre_mapper(genres_json)
+        self.artist_dict = {}
+
+        # load artist genres csv
+        with open(csv_file, "r", encoding="utf-8") as f:
+            csv_reader = csv.reader(f, delimiter="|")
+            for row in csv_reader:
+                if row[0] == "artist_id":
+                    continue  # header
+                self.artist_dict[row[1].strip().lower()] = parse_genre_list(row[2])
+
+        # fuzzy match index over the artist names
+        self.artists = list(self.artist_dict)
+        self._choices = [default_process(a) for a in self.artists]
+
+        self.vote = lru_cache(maxsize=cache_size)(self._vote)
+        self.map = lru_cache(maxsize=cache_size)(self._map)
+
+    def match_artist(self, artist):
+        """The artist name in the csv matching artist, or None"""
+        return self._match_artist(artist)[0]
+
+    def _match_artist(self, artist):
+        # (artist name in the csv, match score), or (None, 0)
+        if artist.strip().lower() in self.artist_dict:
+            return artist.strip().lower(), 100
+
+        result = process.extractOne(
+            default_process(artist),
+            self._choices,
+            scorer=fuzz.WRatio,
+            processor=None,
+            score_cutoff=ARTIST_SCORE_CUTOFF,
+        )
+        if result:
+            logger.debug(f"{artist} -> {self.artists[result[2]]} ({result[1]:.0f})")
+            return self.artists[result[2]], result[1]
+        return None, 0
+
+    def _map(self, artist):
+        return self.vote(artist)[0]
+
+    def _vote(self, artist):
+        """The artist's genre and its confidence (0-1), or (None, 0.0)"""
+        if not artist:
+            return None, 0.0
+        match, score = self._match_artist(artist)
+        if not match:
+            return None, 0.0
+
+        genre_votes = [self.genre_mapper.vote(g) for g in self.artist_dict[match]]
+        genre, share = weighted_vote(genre_votes)
+        return genre, share * score / 100
+
+    def map_many(self, artists):
+        """
+        Map many artists at once, fuzzy matching all the ones without an exact
+        match together in batches, then mapping all their genres together.
+        Returns a dict of artist -> mapped genre.
+        """
+        return {artist: g for artist, (g, _) in self.vote_many(artists).items()}
+
+    def vote_many(self, artists):
+        """map_many, returning a dict of artist -> (genre, confidence)"""
+        matched = {}
+        fuzzy = []
+        for artist in dict.fromkeys(artists):
+            if artist.strip().lower() in self.artist_dict:
+                matched[artist] = (artist.strip().lower(), 100)
+            else:
+                fuzzy.append(artist)
+
+        matches = fuzzy_best_matches(fuzzy, self._choices, ARTIST_SCORE_CUTOFF, 1)
+        for artist, best in zip(fuzzy, matches):
+            matched[artist] = (self.artists[best[0][0]], best[0][1]) if best else None
+
+        genres = self.genre_mapper.vote_many(
+            g for m in matched.values() if m for g in self.artist_dict[m[0]]
+        )
+
+        voted = {}
+        for artist, m in matched.items():
+            if m:
+                match, score = m
+                genre, share = weighted_vote(genres[g] for g in self.artist_dict[match])
+                voted[artist] = (genre, share * score / 100)
+            else:
+                voted[artist] = (None, 0.0)
+        return voted
+
+
+def fuzzy_best_matches(queries, choices, score_cutoff, limit):
+    """
+    Fuzzy match queries against choices (already run through default_process)
+    using rapidfuzz's cdist, a chunk of queries at a time.
+    Returns, per query, (index, score) of up to `limit` choices scoring at
+    least score_cutoff, best first.
+    """
+    matches = []
+    for i in range(0, len(queries), CDIST_CHUNK):
+        scores = process.cdist(
+            [default_process(q) for q in queries[i : i + CDIST_CHUNK]],
+            choices,
+            scorer=fuzz.WRatio,
+            processor=None,
+            score_cutoff=score_cutoff,
+            workers=-1,
+        )
+        for row in scores:
+            best = np.argsort(-row, kind="stable")[:limit]
+            matches.append([(int(j), float(row[j])) for j in best if row[j] > 0])
+    return matches
+
+
+def vote_with_scores(votes):
+    """
+    weighted_vote on (genre, match score) votes.
+    The confidence is the winner's share of the votes, scaled by its best
+    match score.
+    """
+    votes = list(votes)
+    genre, share = weighted_vote(votes)
+    if genre is None:
+        return None, 0.0
+    best_score = max(score for g, score in votes if g == genre)
+    return genre, share * best_score / 100
+
+
+def parse_genre_list(genres):
+    """Parse the list of genres as written to artist_genres.csv, eg "['house', 'disco']" """
+    try:
+        return list(ast.literal_eval(genres))
+    except (ValueError, SyntaxError):
+        return genres.strip("][").replace("'", "").split(", ")
+
+
+@lru_cache(maxsize=None)
+def artist_genre_mapper(csv_file=ARTIST_GENRES_CSV, genres_json=GENRES_JSON):
+    """The ArtistGenreMapper for csv_file, only loaded the first time its needed"""
+    return ArtistGenreMapper(csv_file, genres_json)
 
 
 def map_artist_genre(artist, csv_file=ARTIST_GENRES_CSV, debug=False):
-    artist_dict = {}
-
-    # load artist genres csv
-    with open(csv_file, "r", encoding="utf-8") as f:
-        csv_reader = csv.reader(f, delimiter="|")
-        for row in csv_reader:
-            artist_dict[row[1].strip().lower()] = (
-                row[2].strip("][").replace("'", "").split(", ")
-            )
-    # exact match
-    if artist_genres := artist_dict.get(artist.strip().lower()):
-        artist_genres = [map_genre(g) for g in artist_genres]
-        return most_frequent(artist_genres)
-    # fuzzy match
-    else:
-        all_artists = [k for k, _ in artist_dict.items()]
-        results = process.extractOne(artist, all_artists, score_cutoff=91)
-        if results:
-            if debug:
-                print(results)
-            return map_artist_genre(results[0])
-        else:
-            return None
+    mapper = artist_genre_mapper(csv_file)
+    if debug:
+        print(artist, "->", mapper.match_artist(artist))
+    with metrics.timer("map_artist_genre"):
+        return mapper.map(artist)
 
 
-def remove_accents(input_str):
-    nfkd_form = unicodedata.normalize("NFKD", input_str)
-    return "".join([c for c in nfkd_form if not unicodedata.combining(c)])
+def vote_artist_genre(artist, csv_file=ARTIST_GENRES_CSV):
+    """map_artist_genre, returning (genre, confidence)"""
+    return artist_genre_mapper(csv_file).vote(artist)
 
 
 def print_audio_info(audio):
@@ -0,0 +1,143 @@
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+# my modules
+from .scanner import SCAN_WORKERS, list_mp3s, read_tags, scan_tags
+
+# constants
+LIBRARY_INDEX = os.path.join("data", "library.sqlite")
+INDEX_FRAMES = {
+    "TPE1": "artist",
+    "TIT2": "title",
+    "TPE2": "album_artist",
+    "TCON": "genre",
+    "TLEN": "duration_ms",
+}
+FIELDS = ["path", "size", "mtime", *INDEX_FRAMES.values(), "cleaned"]
+
+# initialise logging
+logger = logging.getLogger(__name__)
+
+
+class LibraryIndex:
+    """
+    Persistent index of mp3 tags, stored in SQLite.
+
+    Each file's size and mtime are stored with its tags, so a rescan only has to
+    stat the files and re-read the tags of the ones that changed.
+    """
+
+    def __init__(self, db_file=LIBRARY_INDEX):
+        Path(db_file).parent.mkdir(parents=True, exist_ok=True)
+        self.db_file = db_file
+        self._con = sqlite3.connect(db_file)
+        self._con.row_factory = sqlite3.Row
+        self._con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                artist TEXT,
+                title TEXT,
+                album_artist TEXT,
+                genre TEXT,
+                duration_ms INTEGER,
+                cleaned TEXT
+            )
+            """
+        )
+        self._con.commit()
+
+    def scan(self, path, recursive=True, workers=SCAN_WORKERS):
+        """
+        Bring the index up to date with the mp3s in path, parsing only new or
+        changed files and dropping deleted ones.
+        Returns the index rows (as dicts) for the mp3s, sorted by path.
+        """
+        root = os.path.abspath(path)
+        mp3s = list_mp3s(root, recursive)
+
+        # what we already know about the files under root
+        indexed = {
+            row["path"]: (row["size"], row["mtime"])
+            for row in self._con.execute(
+                "SELECT path, size, mtime FROM files WHERE path > ? AND path < ?",
+                (root + os.sep, root + chr(ord(os.sep) + 1)),
+            )
+        }
+
+        # find new and changed files, just by their stats
+        changed = []
+        for mp3 in mp3s:
+            st = os.stat(mp3)
+            if indexed.get(mp3) != (st.st_size, st.st_mtime_ns):
+                changed.append((mp3, st))
+
+        # parse the changed files
+        paths = [mp3 for mp3, _ in changed]
+        for (mp3, st), tags in zip(changed, scan_tags(paths, INDEX_FRAMES, workers)):
+            self._upsert(mp3, st, tags)
+
+        # remove the deleted files
+        found = set(mp3s)
+        deleted = [
+            (p,)
+            for p in indexed
+            if p not in found and (recursive or os.path.dirname(p) == root)
+        ]
+        self._con.executemany("DELETE FROM files WHERE path = ?", deleted)
+        self._con.commit()
+
+        logger.info(
+            f"Library index: {len(mp3s)} files, {len(changed)} parsed, {len(deleted)} removed"
+        )
+        return [self.get(mp3) for mp3 in mp3s]
+
+    def get(self, path):
+        row = self._con.execute(
+            "SELECT * FROM files WHERE path = ?", (os.path.abspath(path),)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def update(self, path):
+        """Re-read a single file, eg after its tags were saved"""
+        path = os.path.abspath(path)
+        self._upsert(path, os.stat(path), read_tags(path, INDEX_FRAMES))
+        self._con.commit()
+
+    def rename(self, old, new):
+        self._con.execute(
+            "UPDATE files SET path = ? WHERE path = ?",
+            (os.path.abspath(new), os.path.abspath(old)),
+        )
+        self._con.commit()
+
+    def mark_cleaned(self, path, mode):
+        """Record that clean_tags has processed the file in its current state"""
+        self._con.execute(
+            "UPDATE files SET cleaned = ? WHERE path = ?", (mode, os.path.abspath(path))
+        )
+        self._con.commit()
+
+    def reset_cleaned(self):
+        """Have clean_tags look at every file again, eg once the genre mapping changes"""
+        self._con.execute("UPDATE files SET cleaned = NULL")
+        self._con.commit()
+
+    def close(self):
+        self._con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _upsert(self, path, st, tags):
+        self._con.execute(
+            f"INSERT OR REPLACE INTO files VALUES ({', '.join('?' * len(FIELDS))})",
+            (path, st.st_size, st.st_mtime_ns, *tags.values(), None),
+        )
@@ -0,0 +1,62 @@
+"""
+Picking the right spotify track out of several search results, by how well
+each matches the song's artist, title and (when known) duration.
+"""
+
+# my modules
+from .normalize import clean_artist, clean_song_title
+
+# constants
+SEARCH_CANDIDATES = 5  # search results scored per song
+MATCH_THRESHOLD = 60  # lowest score (0-100) accepted as a match
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.4
+DURATION_WEIGHT = 0.1
+DURATION_TOLERANCE_MS = 2000  # durations this close score full marks
+DURATION_MAX_DIFF_MS = 30000  # ...down to zero this far apart
+
+
+def score_candidates(artist, title, candidates, duration_ms=None):
+    """
+    Score spotify track results (0-100) against a song's cleaned artist and
+    title, scoring all the candidates together with rapidfuzz.
+    """
+    # rapidfuzz is slow to import, only load it once there are results to score
+    from rapidfuzz import fuzz, process
+
+    titles = [clean_song_title(c["name"]) or "" for c in candidates]
+    artists = [
+        " ".join(clean_artist(a["name"]) or "" for a in c["artists"])
+        for c in candidates
+    ]
+
+    title_scores = process.cdist([title or ""], titles, scorer=fuzz.WRatio)[0]
+    artist_scores = process.cdist(
+        [artist or ""], artists, scorer=fuzz.token_set_ratio
+    )[0]
+    scores = TITLE_WEIGHT * title_scores + ARTIST_WEIGHT * artist_scores
+
+    if not duration_ms:
+        return scores / (TITLE_WEIGHT + ARTIST_WEIGHT)
+
+    import numpy as np  # already loaded by cdist, not worth loading up front
+
+    durations = np.array([c.get("duration_ms") or 0 for c in candidates])
+    diffs = np.abs(durations - duration_ms) - DURATION_TOLERANCE_MS
+    duration_scores = 100 * np.clip(
+        1 - diffs / (DURATION_MAX_DIFF_MS - DURATION_TOLERANCE_MS), 0, 1
+    )
+    return scores + DURATION_WEIGHT * duration_scores
+
+
+def best_match(artist, title, candidates, duration_ms=None, threshold=MATCH_THRESHOLD):
+    """
+    The best scoring candidate and its score, or None (and the best score) if
+    none score at least threshold. Ties go to spotify's ordering.
+    """
+    if not candidates:
+        return None, 0.0
+
+    scores = score_candidates(artist, title, candidates, duration_ms)
+    i = int(scores.argmax())
+    return (candidates[i] if scores[i] >= threshold else None), float(scores[i])
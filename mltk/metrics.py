@@ -0,0 +1,215 @@
+"""
+Lightweight timers and counters, to see where a run's time went: tag parsing,
+genre mapping, spotify calls, rate limit waits, file writes.
+
+Off by default, when timing something costs next to nothing. Once enabled
+(main.py --metrics), summary() gives the call count, total and p50/p95/max of
+each timer along with the counters, and write_summary saves it as json.
+
+    with metrics.timer("spotify.search"):
+        results = sp.search(...)
+    metrics.count("spotify.retries")
+
+Worker processes (scan_tags and clean_tags with workers > 1) measure their own
+calls once start_worker is called in them, and hand them back with take() for
+the parent to merge().
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+# constants
+PROFILERS = ["cprofile", "pyinstrument"]
+
+# initialise logging
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Named timers (lists of durations) and counters, safe to share between threads"""
+
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.timings = defaultdict(list)
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.perf_counter()
+
+    def timer(self, name):
+        """Time the with block under name"""
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self, name)
+
+    def timed(self, name):
+        """Decorator timing every call of a function under name"""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name, secs):
+        if self.enabled:
+            with self._lock:
+                self.timings[name].append(secs)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def summary(self):
+        """Dict of the run's wall time, timer stats (in ms) and counters"""
+        with self._lock:
+            timings = {name: sorted(secs) for name, secs in self.timings.items()}
+            counters = dict(self.counters)
+
+        timers = {}
+        for name, secs in sorted(timings.items()):
+            timers[name] = {
+                "calls": len(secs),
+                "total_s": round(sum(secs), 3),
+                "p50_ms": round(1000 * percentile(secs, 0.5), 2),
+                "p95_ms": round(1000 * percentile(secs, 0.95), 2),
+                "max_ms": round(1000 * secs[-1], 2),
+            }
+
+        wall = time.perf_counter() - self.started if self.started else 0
+        return {
+            "wall_s": round(wall, 3),
+            "timers": timers,
+            "counters": {k: round(v, 3) for k, v in sorted(counters.items())},
+        }
+
+    def write_summary(self, out_file):
+        summary = self.summary()
+        Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(out_file, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4)
+
+        for name, t in summary["timers"].items():
+            logger.info(
+                f"{name}: {t['calls']} calls, {t['total_s']}s total, "
+                f"p50 {t['p50_ms']}ms, p95 {t['p95_ms']}ms"
+            )
+        for name, n in summary["counters"].items():
+            logger.info(f"{name}: {n}")
+        logger.info(f"Metrics written to {out_file}")
+
+    def reset(self):
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    def start_worker(self, enabled):
+        """
+        Set up the metrics of a worker process, enabled if the parent's are.
+        Anything inherited from the parent (when forked) is dropped, so it
+        isn't merged back twice.
+        """
+        self.reset()
+        self.enabled = enabled
+
+    def take(self):
+        """
+        The timings and counters recorded since the last take, for merge, and
+        clears them. None if nothing was recorded.
+        """
+        with self._lock:
+            if not (self.timings or self.counters):
+                return None
+            taken = {"timings": dict(self.timings), "counters": dict(self.counters)}
+            self.timings = defaultdict(list)
+            self.counters = Counter()
+        return taken
+
+    def merge(self, taken):
+        """Add the timings and counters taken from another process"""
+        if not (self.enabled and taken):
+            return
+        with self._lock:
+            for name, secs in taken["timings"].items():
+                self.timings[name].extend(secs)
+            self.counters.update(taken["counters"])
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+
+# what timer gives when disabled, so an untimed with block costs next to nothing
+_NO_TIMER = nullcontext()
+
+
+def percentile(sorted_values, q):
+    """The q (0-1) percentile of an already sorted list, 0 if its empty"""
+    if not sorted_values:
+        return 0
+    return sorted_values[int(q * (len(sorted_values) - 1))]
+
+
+@contextmanager
+def profile(profiler, out_file):
+    """
+    Profile the with block with cProfile (stats for pstats / snakeviz) or
+    pyinstrument (an html report, needs pyinstrument installed).
+    """
+    if profiler == "pyinstrument":
+        try:
+            import pyinstrument
+        except ImportError:
+            raise ImportError(
+                "pyinstrument profiling needs pyinstrument, install it with: "
+                "pip install pyinstrument"
+            )
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            Path(out_file).write_text(profiler.output_html(), encoding="utf-8")
+            logger.info(f"Profile written to {out_file}")
+
+    elif profiler == "cprofile":
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(out_file)
+            logger.info(f"Profile written to {out_file}")
+
+    else:
+        raise ValueError(f"Unknown profiler {profiler}, expected one of {PROFILERS}")
+
+
+# the metrics of this run, shared by all the modules
+metrics = Metrics()
@@ -0,0 +1,103 @@
+"""
+Text normalization for matching songs and artists.
+
+The patterns are compiled once and the cleaned strings memoized, since the
+same artists and titles come up over and over (once per search, once per file
+when mapping genres). The batch functions clean a whole list at a time: each
+distinct value once, with the patterns run over all of them in one go.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+# constants
+NORMALIZE_CACHE_SIZE = 2**16  # per function
+
+# patterns
+ROUND_BRACKETS = re.compile(r"\([^\)]*\)")
+SQUARE_BRACKETS = re.compile(r"\[[^\]]*\]")
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-zA-Z ]+")
+# the first featured / collaborating artist separator
+ARTIST_SEPARATOR = re.compile(r" (?:ft|feat|&|vs) ")
+# the same, for a batch of values joined by newlines
+ROUND_BRACKETS_LINES = re.compile(r"\([^\)\n]*\)")
+SQUARE_BRACKETS_LINES = re.compile(r"\[[^\]\n]*\]")
+NON_ALPHANUMERIC_LINES = re.compile(r"[^0-9a-zA-Z \n]+")
+ARTIST_SEPARATOR_LINES = re.compile(r" (?:ft|feat|&|vs) [^\n]*")
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def clean_song_title(title, keep_brackets=False):
+    if title:
+        if not keep_brackets:
+            title = ROUND_BRACKETS.sub("", title)
+            title = SQUARE_BRACKETS.sub("", title)
+        title = NON_ALPHANUMERIC.sub("", title.lower())
+        return title.strip()
+    else:
+        return None
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def clean_artist(artist):
+    if artist:
+        artist = ARTIST_SEPARATOR.split(artist.lower(), maxsplit=1)[0]
+        artist = NON_ALPHANUMERIC.sub("", artist)
+        return artist.strip()
+    else:
+        return None
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def remove_accents(input_str):
+    if input_str.isascii():
+        return input_str
+    nfkd_form = unicodedata.normalize("NFKD", input_str)
+    return "".join([c for c in nfkd_form if not unicodedata.combining(c)])
+
+
+def clean_song_titles(titles, keep_brackets=False):
+    """clean_song_title for each of titles, as a list"""
+    return _clean_many(titles, _clean_song_title_lines, clean_song_title, keep_brackets)
+
+
+def clean_artists(artists):
+    """clean_artist for each of artists, as a list"""
+    return _clean_many(artists, _clean_artist_lines, clean_artist)
+
+
+def remove_accents_many(strings):
+    """remove_accents for each of strings, as a list"""
+    strings = list(strings)
+    cleaned = {value: remove_accents.__wrapped__(value) for value in set(strings)}
+    return [cleaned[value] for value in strings]
+
+
+def _clean_song_title_lines(text, keep_brackets):
+    if not keep_brackets:
+        text = ROUND_BRACKETS_LINES.sub("", text)
+        text = SQUARE_BRACKETS_LINES.sub("", text)
+    return NON_ALPHANUMERIC_LINES.sub("", text.lower())
+
+
+def _clean_artist_lines(text):
+    text = ARTIST_SEPARATOR_LINES.sub("", text.lower())
+    return NON_ALPHANUMERIC_LINES.sub("", text)
+
+
+def _clean_many(values, clean_lines, clean_one, *args):
+    """
+    Clean the distinct values as one newline joined string, so each pattern
+    runs once over the whole batch rather than once per value.
+    Values with newlines of their own (eg multi-value tags) are cleaned one at
+    a time with clean_one instead.
+    """
+    values = list(values)
+    distinct = [value for value in set(values) if value]
+    cleaned = {value: clean_one(value, *args) for value in distinct if "\n" in value}
+    distinct = [value for value in distinct if value not in cleaned]
+
+    lines = clean_lines("\n".join(distinct), *args).split("\n")
+    cleaned.update((value, line.strip()) for value, line in zip(distinct, lines))
+    return [cleaned[value] if value else None for value in values]
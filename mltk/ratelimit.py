@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+
+# my modules
+from .metrics import metrics
+
+# constants
+MAX_RETRIES = 5
+DEFAULT_RETRY_AFTER = 1  # seconds, if spotify doesn't send a Retry-After header
+RATE = 5  # requests per second a TokenBucket starts at
+MIN_RATE = 0.2
+MAX_RATE = 20
+RATE_INCREASE = 0.5  # added to the rate after each successful request
+
+# initialise logging
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Adaptive token bucket rate limiter, safe to share between threads.
+
+    Each request takes a token, waiting for one if the bucket is empty. Tokens
+    refill at `rate` per second, which is raised a little after each successful
+    request and halved on a 429, when everyone also waits out the Retry-After.
+    """
+
+    def __init__(self, rate=RATE, capacity=None, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = self.capacity
+        self.paused_until = 0
+        self.n_throttled = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, blocking until one is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            metrics.count("ratelimit.wait_seconds", wait)
+            time.sleep(wait)
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def throttled(self, wait):
+        """Slow down after a 429, pausing all requests for wait seconds"""
+        with self._lock:
+            self.n_throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + wait)
+
+
+def retry_after(e, default=DEFAULT_RETRY_AFTER):
+    """Seconds to wait before retrying, as told by a 429 response"""
+    try:
+        return max(float(e.headers.get("Retry-After", default)), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+def session_gave_up(e):
+    """
+    Whether a 429 is really spotipy giving up after its session's own retries
+    (it raises those as a 429 "Max Retries" without any headers), in which
+    case the request may or may not have gone through.
+    """
+    return e.http_status == 429 and not e.headers
+
+
+def call_with_backoff(func, *args, max_retries=MAX_RETRIES, limiter=None, **kwargs):
+    """
+    Call a spotipy function, sleeping and retrying whenever spotify responds
+    with HTTP 429 (too many requests). A 429 from the session giving up is
+    raised instead, see session_gave_up.
+    With a TokenBucket limiter, calls are paced by it and 429s slow it down.
+    """
+    # spotipy is slow to import, only load it once there's a call to make
+    from spotipy.exceptions import SpotifyException
+
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except SpotifyException as e:
+            if e.http_status != 429 or session_gave_up(e) or attempt == max_retries:
+                raise
+            wait = retry_after(e)
+            metrics.count("spotify.retries")
+            metrics.count("spotify.backoff_seconds", wait)
+            logger.warning(f"Rate limited by spotify, retrying in {wait}s")
+            if limiter:
+                limiter.throttled(wait)
+            else:
+                time.sleep(wait)
+        else:
+            if limiter:
+                limiter.success()
+            return result
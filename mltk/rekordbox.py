@@ -0,0 +1,78 @@
+"""
+Reading songs from rekordbox exports, one at a time.
+
+Either a playlist exported as text (File > Export > playlist as .txt, a utf16
+tab separated file) or the collection exported as xml (File > Export Collection
+in xml format). The xml is read incrementally and each track thrown away once
+its been yielded, so memory stays flat however big the collection is.
+"""
+
+import csv
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+# constants
+ARTIST_SEPARATOR = ", "  # how rekordbox lists multiple artists
+
+
+def iter_rekordbox(rb_file):
+    """Yield the songs of a rekordbox .xml collection or .txt playlist export"""
+    if Path(rb_file).suffix.lower() == ".xml":
+        return iter_rekordbox_xml(rb_file)
+    else:
+        return iter_rekordbox_txt(rb_file)
+
+
+def iter_rekordbox_txt(txt_file):
+    """Yield the songs of a rekordbox playlist exported as text"""
+    with open(txt_file, "r", encoding="utf-16", newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            duration_ms = parse_duration(row.get("Time"))
+            yield make_song(row["Artist"], row["Track Title"], duration_ms)
+
+
+def iter_rekordbox_xml(xml_file):
+    """Yield the songs in the COLLECTION of a rekordbox xml export"""
+    collection = None
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if elem.tag == "COLLECTION":
+            if event == "start":
+                collection = elem
+                continue
+            # the playlists after the collection only refer back to its tracks
+            break
+
+        if event == "end" and elem.tag == "TRACK" and collection is not None:
+            total_time = elem.get("TotalTime")
+            yield make_song(
+                elem.get("Artist"),
+                elem.get("Name"),
+                int(total_time) * 1000 if total_time and total_time.isdigit() else None,
+            )
+            # done with this track (and any before it)
+            collection.clear()
+
+
+def make_song(artist, title, duration_ms=None):
+    """
+    A song record as written to the json files. When there's more than one
+    artist, "artist" is the first and "artists" has them all.
+    """
+    artists = [a.strip() for a in (artist or "").split(ARTIST_SEPARATOR) if a.strip()]
+    song = {"artist": artists[0] if artists else artist, "title": title}
+    if len(artists) > 1:
+        song["artists"] = artists
+    if duration_ms:
+        song["duration_ms"] = duration_ms
+    return song
+
+
+def parse_duration(time):
+    """Milliseconds in a track length like "05:32" or "1:05:32", or None"""
+    try:
+        secs = 0
+        for part in time.split(":"):
+            secs = secs * 60 + int(part)
+        return secs * 1000
+    except (AttributeError, ValueError):
+        return None
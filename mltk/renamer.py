@@ -1,36 +1,46 @@
 import eyed3
 import os
 import re
-import unicodedata
 from tqdm import tqdm
 from pathlib import Path
 
-def rename_mp3_in_dir(path, debug=False):
-    for file in sorted(os.listdir(path)):
-        if file.endswith(".mp3"):
-            mp3 = os.path.join(path, file)
-            # print(mp3)
-            audio = eyed3.load(mp3)
+# my modules
+from .library import LibraryIndex
+from .normalize import remove_accents
+from .scanner import list_mp3s, read_tags
 
-            # check existence af.tag.artist
-            if hasattr(audio, "tag"):
-                # check existence af.tag.artist, title
-                if all(hasattr(audio.tag, attr) for attr in ["artist", "title"]):
-                    # check Empty
-                    if audio.tag.artist and audio.tag.title:
-                        new_filename = f"{audio.tag.artist} - {audio.tag.title}.mp3"
-                        # delete unix chars
-                        new_filename = re.sub(
-                            r'[\x00\\/\:*"<>\|\\`\'\%\$\^&£]', "", new_filename
-                        )
-                        print(file, "->", new_filename)
 
-                        if not debug:
-                            os.rename(mp3, os.path.join(path, new_filename))
+def rename_mp3_in_dir(path, debug=False, index_file=None):
+    # with a library index, only new or changed files get their tags read
+    index = LibraryIndex(index_file) if index_file else None
+    if index:
+        songs = index.scan(path, recursive=False)
+    else:
+        songs = [{"path": mp3, **read_tags(mp3)} for mp3 in list_mp3s(path)]
 
-                        continue
+    for song in songs:
+        mp3 = song["path"]
+        file = os.path.basename(mp3)
 
-            print("Skipping", file)
+        # check Empty
+        if song["artist"] and song["title"]:
+            new_filename = f"{song['artist']} - {song['title']}.mp3"
+            # delete unix chars
+            new_filename = re.sub(r'[\x00\\/\:*"<>\|\\`\'\%\$\^&£]', "", new_filename)
+            print(file, "->", new_filename)
+
+            if not debug:
+                new_path = os.path.join(os.path.dirname(mp3), new_filename)
+                os.rename(mp3, new_path)
+                if index:
+                    index.rename(mp3, new_path)
+
+            continue
+
+        print("Skipping", file)
+
+    if index:
+        index.close()
 
 
 def remove_accents_from_tags(audio_file):
@@ -73,11 +83,6 @@ def remove_accents_from_tags(audio_file):
             print("Issue saving tag...skipping: ", audio.path)
 
 
-def remove_accents(input_str):
-    nfkd_form = unicodedata.normalize('NFKD', input_str)
-    return u"".join([c for c in nfkd_form if not unicodedata.combining(c)])
-
-
 if __name__ == "__main__":
     # path = "/home/nickneos/Music/Collections/Neos' Old School Urban Collection/"
     # rename_mp3_in_dir(path, debug=True)
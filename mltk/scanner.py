@@ -0,0 +1,183 @@
+"""
+Fast mp3 tag scanning.
+
+Rather than eyed3.load, which parses every ID3 frame plus the MPEG headers,
+read_tags walks the ID3v2 frame headers and only decodes the frames asked for,
+seeking past everything else (cover art etc). Anything it doesn't understand
+(ID3v2.2, unsynchronised or compressed frames, files with only an ID3v1 tag)
+falls back to eyed3.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# my modules
+from .metrics import metrics
+
+# constants
+# frame id -> eyed3 tag attribute (TLEN has none, so only the fast path reads it)
+FRAMES = {"TPE1": "artist", "TIT2": "title", "TLEN": "duration_ms"}
+SCAN_WORKERS = os.cpu_count() or 1
+CHUNKSIZE = 64  # files handed to a worker process at a time
+TEXT_CODECS = {0: "latin_1", 1: "utf_16", 2: "utf_16_be", 3: "utf_8"}
+
+# header flags that the fast path can't deal with
+TAG_UNSYNC = 0x80
+TAG_EXTENDED_HEADER = 0x40
+FRAME_FORMAT_FLAGS = {3: 0xE0, 4: 0x4F}  # compression, encryption, grouping, etc
+
+# initialise logging
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedTag(Exception):
+    pass
+
+
+def list_mp3s(path, recursive=False):
+    """Sorted paths of the mp3 files in a directory"""
+    files = Path(path).rglob("*.mp3") if recursive else Path(path).glob("*.mp3")
+    return sorted(str(f) for f in files if f.is_file())
+
+
+def read_tags(path, frames=FRAMES):
+    """
+    Read the given ID3 frames from an mp3.
+    Returns a dict of the frames' tag attribute names to their values, where
+    frames missing from the file are None. A file that can't be read is logged
+    and has all its frames None, so one corrupt file doesn't stop a scan.
+    """
+    try:
+        try:
+            tags = _read_id3v2(path, frames)
+        except UnsupportedTag:
+            tags = _read_eyed3(path, frames)
+    except Exception as e:
+        logger.warning(f"Failed to read tags of {path}: {type(e).__name__} - {e}")
+        tags = {}
+
+    # same as eyed3, turn id3v1 genre ids like "(35)" into names
+    if "TCON" in frames and (genre := tags.get(frames["TCON"])):
+        from eyed3.id3 import Genre
+
+        genre = Genre.parse(genre)
+        tags[frames["TCON"]] = genre.name if genre else None
+
+    # song length in milliseconds
+    if "TLEN" in frames and (length := tags.get(frames["TLEN"])):
+        tags[frames["TLEN"]] = int(length) if length.strip().isdigit() else None
+
+    return {attr: tags.get(attr) for attr in frames.values()}
+
+
+def scan_tags(paths, frames=FRAMES, workers=SCAN_WORKERS):
+    """
+    Yield read_tags for each path, in order, as they're read.
+    With more than one worker the files are spread across a process pool.
+    """
+    if workers <= 1 or len(paths) <= CHUNKSIZE:
+        for path in paths:
+            yield read_tags(path, frames)
+        return
+
+    # the workers hand back what they measured with each file's tags
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=metrics.start_worker,
+        initargs=(metrics.enabled,),
+    ) as executor:
+        for tags, taken in executor.map(
+            _scan_worker, paths, [frames] * len(paths), chunksize=CHUNKSIZE
+        ):
+            metrics.merge(taken)
+            yield tags
+
+
+def _scan_worker(path, frames):
+    # the tags, with what reading them measured for the parent to merge
+    tags = read_tags(path, frames)
+    return tags, metrics.take()
+
+
+def _read_id3v2(path, frames):
+    tags = {}
+
+    with open(path, "rb") as f:
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b"ID3":
+            raise UnsupportedTag("no ID3v2 tag")
+
+        version, flags = header[3], header[5]
+        if version not in (3, 4) or flags & TAG_UNSYNC:
+            raise UnsupportedTag(f"ID3v2.{version} flags {flags:#x}")
+        # a truncated file (eg a partial download) holds less than its header says
+        end = min(10 + _syncsafe(header[6:10]), os.fstat(f.fileno()).st_size)
+
+        # skip the extended header
+        if flags & TAG_EXTENDED_HEADER:
+            size = f.read(4)
+            if version == 4:
+                f.seek(_syncsafe(size) - 4, os.SEEK_CUR)
+            else:
+                f.seek(int.from_bytes(size, "big"), os.SEEK_CUR)
+
+        while len(tags) < len(frames) and f.tell() + 10 <= end:
+            frame_header = f.read(10)
+            frame_id = frame_header[:4]
+            if len(frame_header) < 10 or frame_id[:1] == b"\x00":
+                break  # into the padding, or out of file
+
+            if version == 4:
+                size = _syncsafe(frame_header[4:8])
+            else:
+                size = int.from_bytes(frame_header[4:8], "big")
+
+            attr = frames.get(frame_id.decode("latin_1"))
+            if attr is None:
+                f.seek(size, os.SEEK_CUR)
+                continue
+
+            if frame_header[9] & FRAME_FORMAT_FLAGS[version]:
+                raise UnsupportedTag(f"{frame_id} flags {frame_header[9]:#x}")
+            tags[attr] = _decode_text(f.read(size))
+
+    return tags
+
+
+def _read_eyed3(path, frames):
+    # eyed3 is slow to import, and only needed for the files the fast path can't read
+    import eyed3
+    from eyed3.id3 import Genre
+
+    with metrics.timer("eyed3.load"):
+        audio = eyed3.load(path)
+    if audio is None or audio.tag is None:
+        return {}
+
+    tags = {}
+    for attr in frames.values():
+        value = getattr(audio.tag, attr, None)
+        tags[attr] = value.name if isinstance(value, Genre) else value
+    return tags
+
+
+def _syncsafe(data):
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+
+def _decode_text(data):
+    if not data:
+        return None
+
+    codec = TEXT_CODECS.get(data[0], "latin_1")
+    text = data[1:]
+    # same fix up as eyed3 for utf16 with a stray trailing null
+    if codec.startswith("utf_16") and len(text) % 2 and text[-1:] == b"\x00":
+        text = text[:-1]
+    try:
+        return str(text, codec).rstrip("\x00")
+    except UnicodeDecodeError as e:
+        logger.warning(f"Error decoding text frame: {e}")
+        return ""
@@ -0,0 +1,207 @@
+"""
+The working file of songs passed between the stages of spotiply, stored in
+SQLite instead of one big json list.
+
+Each song is a row keyed on a stable key made from its artist and title, so
+stages can read the songs as a stream and update a single song in place
+instead of rewriting the whole list. The json files are still supported, by
+load_songs / write_songs, and convert_songs converts between the two.
+"""
+
+import json
+import logging
+import sqlite3
+import textwrap
+from pathlib import Path
+
+# my modules
+from .metrics import metrics
+from .utils import batched
+
+# constants
+SONG_STORE_SUFFIXES = (".sqlite", ".db")
+INSERT_BATCH_SIZE = 1000
+READ_BATCH_SIZE = 1000
+
+# initialise logging
+logger = logging.getLogger(__name__)
+
+
+def is_song_store(file):
+    """Whether file is a song store (rather than a json file), by its extension"""
+    return Path(file).suffix.lower() in SONG_STORE_SUFFIXES
+
+
+def song_key(song, seen=None):
+    """
+    Stable key of a song, from its artist and title.
+    With a dict of the keys seen so far, repeats of a song get "#2", "#3"...,
+    skipping any already taken (eg by a song titled "b#2").
+    """
+    base = f"{song.get('artist') or ''} - {song.get('title') or ''}".lower()
+    key = base
+    if seen is not None:
+        n = seen.get(base, 1)
+        while key in seen:
+            n += 1
+            key = f"{base}#{n}"
+        seen[base] = n
+        seen.setdefault(key, 1)
+    return key
+
+
+def load_songs(songs_file):
+    """The songs in a json file (as a list) or song store (as a generator)"""
+    if is_song_store(songs_file):
+        return _iter_store(songs_file)
+    with open(songs_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _iter_store(db_file):
+    with SongStore(db_file) as store:
+        yield from store
+
+
+def write_songs(songs, songs_file):
+    """
+    Write songs out to a json file or song store as they come.
+    Returns the number of songs written.
+    """
+    if is_song_store(songs_file):
+        with SongStore(songs_file) as store:
+            return store.replace(songs)
+    return dump_songs_json(songs, songs_file)
+
+
+def dump_songs_json(songs, out_file):
+    """
+    Write songs out as they come, in the same layout as json.dump.
+    Returns the number of songs written.
+    """
+    n_songs = 0
+    with open(out_file, "w", encoding="utf-8", newline="") as f:
+        f.write("[")
+        for song in songs:
+            with metrics.timer("write.songs_json"):
+                f.write(",\n" if n_songs else "\n")
+                f.write(textwrap.indent(json.dumps(song, indent=4), " " * 4))
+            n_songs += 1
+        f.write("\n]" if n_songs else "]")
+
+    return n_songs
+
+
+def convert_songs(in_file, out_file):
+    """Convert between a json songs file and a song store (either way round)"""
+    write_songs(load_songs(in_file), out_file)
+    logger.info(f"Converted {in_file} to {out_file}")
+
+
+class SongStore:
+    """
+    SQLite store of song dicts, in the order they were added.
+    Each song is stored under a key (see song_key), which batches gives with
+    the songs so they can be updated. The key isn't part of the song itself.
+    """
+
+    def __init__(self, db_file):
+        Path(db_file).parent.mkdir(parents=True, exist_ok=True)
+        self.db_file = db_file
+        self._con = sqlite3.connect(db_file)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS songs (
+                key TEXT PRIMARY KEY,
+                pos INTEGER NOT NULL,
+                song TEXT NOT NULL
+            )
+            """
+        )
+        self._con.execute("CREATE INDEX IF NOT EXISTS songs_pos ON songs (pos)")
+        self._con.commit()
+
+    def replace(self, songs):
+        """
+        Replace the contents of the store with songs (any iterable of song
+        dicts), inserted a batch at a time as they come.
+        Returns the number of songs written.
+        """
+        self._con.execute("DELETE FROM songs")
+        seen = {}
+        n_songs = 0
+        for batch in batched(songs, INSERT_BATCH_SIZE):
+            rows = []
+            for song in batch:
+                rows.append((song_key(song, seen), n_songs, _dumps(song)))
+                n_songs += 1
+            self._insert(rows)
+        with metrics.timer("write.song_store_insert"):
+            self._con.commit()
+        return n_songs
+
+    def _insert(self, rows):
+        with metrics.timer("write.song_store_insert"):
+            # a plain insert, so a clashing key raises rather than losing a song
+            self._con.executemany("INSERT INTO songs VALUES (?, ?, ?)", rows)
+
+    def update(self, key, song):
+        """Write back the song stored under key"""
+        self.update_many([(key, song)])
+
+    def update_many(self, keyed_songs):
+        """Write back a batch of (key, song) pairs, in one transaction"""
+        with metrics.timer("write.song_store_update"):
+            self._con.executemany(
+                "UPDATE songs SET song = ? WHERE key = ?",
+                [(_dumps(song), key) for key, song in keyed_songs],
+            )
+            self._con.commit()
+
+    def batches(self, batch_size=READ_BATCH_SIZE):
+        """
+        Yield the songs in order as lists of up to batch_size (key, song) pairs.
+        Each batch is read by its own query, so the store can be updated in
+        between.
+        """
+        pos = -1
+        while True:
+            rows = self._con.execute(
+                "SELECT pos, key, song FROM songs WHERE pos > ? ORDER BY pos LIMIT ?",
+                (pos, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            pos = rows[-1][0]
+            yield [(key, _loads(song)) for _, key, song in rows]
+
+    def __iter__(self):
+        """Yield the songs in order, without loading them all at once"""
+        cur = self._con.execute("SELECT song FROM songs ORDER BY pos")
+        for (song,) in cur:
+            yield _loads(song)
+
+    def __len__(self):
+        return self._con.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def close(self):
+        self._con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _dumps(song):
+    # songs from files written by older versions may still carry their key
+    return json.dumps({k: v for k, v in song.items() if k != "key"})
+
+
+def _loads(song):
+    song = json.loads(song)
+    song.pop("key", None)
+    return song
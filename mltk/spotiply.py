@@ -1,168 +1,551 @@
 import csv
-import eyed3
 import json
 import logging
 import os
-import spotipy
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path, PurePosixPath
-from spotipy import util
-from spotipy.oauth2 import SpotifyOAuth
-from tqdm import tqdm
 from urllib.parse import unquote, urlparse
 
 # my modules
-from .utils import clean_artist, clean_song_title
+from .cache import SearchCache
+from .library import LibraryIndex
+from .matching import SEARCH_CANDIDATES, best_match
+from .metrics import metrics
+from .ratelimit import MAX_RETRIES, TokenBucket, call_with_backoff, session_gave_up
+from .rekordbox import iter_rekordbox
+from .scanner import SCAN_WORKERS, list_mp3s, scan_tags
+from .songstore import SongStore, is_song_store, load_songs, write_songs
+from .normalize import clean_artist, clean_artists, clean_song_title
+from .utils import batched, dump_json_atomic
 
 # constants
 CREDENTIALS = "credentials.json"
 SPOTIFY_TRACK_URL = "https://open.spotify.com/track/"
+STATUS_FORCELIST = (500, 502, 503, 504)  # retried by the session, not 429s
+SESSION_RETRIES = 3
+# methods the session may retry, not POST as a failed add may still have added
+SESSION_RETRY_METHODS = frozenset(["GET", "PUT", "DELETE"])
+SEARCH_WORKERS = 4
+SEARCH_TIERS = ["strict", "remix", "loose"]  # see QUERY_TIERS
+CHECKPOINT_EVERY = 100  # songs searched (and saved) at a time
+PLAYLIST_BATCH_SIZE = 100  # the most tracks spotify will add in one request
+PAGE_SIZE = 50  # the most tracks spotify will return at a time
+PREFETCH_WORKERS = 4  # pages of an export fetched at a time
+EXPORT_FORMATS = ["csv", "jsonl", "parquet"]
+EXPORT_FORMAT = "csv"  # tab delimited
+TRACK_FIELDS = ["Num", "Title", "Artists", "TrackID", "URL"]
 
 # initialise logging
 logger = logging.getLogger(__name__)
 
 
-def music_dir_to_json(path, out_file):
+def music_dir_to_json(
+    path, out_file, recursive=False, workers=SCAN_WORKERS, index_file=None
+):
     logger.info(f"Exporting songs to {out_file}")
-    songs = []
-    for file in sorted(os.listdir(path)):
-        if file.endswith(".mp3"):
-            mp3 = os.path.join(path, file)
-            audio = eyed3.load(mp3)
+    # songs are written out as they're scanned
+    return write_songs(scan_songs(path, recursive, workers, index_file), out_file)
 
-            song = {"artist": audio.tag.artist, "title": audio.tag.title}
-            songs.append(song)
 
-    with open(out_file, "w", encoding="utf-8", newline="") as f:
-        json.dump(songs, f, indent=4)
+def scan_songs(path, recursive=False, workers=SCAN_WORKERS, index_file=None):
+    """Yield the songs of the mp3s in path, as their tags are read"""
+    # with a library index only new or changed files get their tags read
+    if index_file:
+        with LibraryIndex(index_file) as index:
+            scanned = index.scan(path, recursive, workers)
+    else:
+        from tqdm import tqdm
 
-    return songs
+        mp3s = list_mp3s(path, recursive)
+        scanned = tqdm(scan_tags(mp3s, workers=workers), total=len(mp3s))
 
+    for tags in scanned:
+        yield scanned_song(tags)
 
-def rbox_to_json(txt_file, out_file):
-    logger.info(f"Exporting reckordbox txt file to {out_file}")
-    songs = []
 
-    with open(txt_file, "r", encoding="utf-16", newline="") as f:
-        dr = csv.DictReader(f, delimiter="\t")
-        for row in dr:
-            song = {"artist": row["Artist"].split(", ")[0], "title": row["Track Title"]}
-            songs.append(song)
+def scanned_song(tags):
+    song = {"artist": tags["artist"], "title": tags["title"]}
+    if tags["duration_ms"]:
+        song["duration_ms"] = tags["duration_ms"]
+    return song
 
-    with open(out_file, "w", encoding="utf-8", newline="") as f:
-        json.dump(songs, f, indent=4)
 
-    return songs
+def rbox_to_json(rb_file, out_file):
+    """
+    Export the songs of a rekordbox .txt playlist or .xml collection to json
+    (or a song store)
+    """
+    logger.info(f"Exporting rekordbox file to {out_file}")
+    return write_songs(iter_rekordbox(rb_file), out_file)
+
+
+def get_spotify_track_id(
+    sp,
+    json_file,
+    workers=SEARCH_WORKERS,
+    cache_file=None,
+    resume=False,
+    checkpoint_every=CHECKPOINT_EVERY,
+    tiers=SEARCH_TIERS,
+    songs=None,
+):
+    """
+    Search spotify for the songs in json_file, adding the matches to it.
+    If songs (any iterable of song dicts, eg from iter_rekordbox) are given
+    they're searched instead, and written to json_file with the matches.
+
+    The songs are searched checkpoint_every at a time, saving the matches
+    after each batch. json_file can also be a song store (see songstore), in
+    which case the songs are read from it a batch at a time and each batch
+    written back once its searched, so memory doesn't grow with the library.
+
+    Each batch is searched with each query tier in turn (see QUERY_TIERS), a
+    tier only searching the songs all the tiers before it missed.
+    Returns the songs, as a list for a json file and a generator reading them
+    back for a song store (like load_songs).
+    """
+    from tqdm import tqdm
+
+    batch_size = max(1, checkpoint_every or CHECKPOINT_EVERY)
+    store = SongStore(json_file) if is_song_store(json_file) else None
+    if store is not None:
+        if songs is not None:
+            store.replace(songs)
+        n_songs = len(store)
+        batches = store.batches(batch_size)
+    else:
+        songs = list(songs) if songs is not None else load_songs(json_file)
+        n_songs = len(songs)
+        # (key, song) pairs like the store's, the json file needs no keys
+        batches = ([(None, s) for s in b] for b in batched(songs, batch_size))
+
+    # previous search results are reused from the cache, if one is given
+    cache = SearchCache(cache_file) if cache_file else None
+    tier_stats = {tier: {"searched": 0, "found": 0, "ms": Counter()} for tier in tiers}
+    not_found_file = Path(json_file).with_name(Path(json_file).stem + "-not_found.txt")
+    n_skipped = 0
+
+    # search for the songs on spotify, `workers` searches at a time
+    logger.info(f"Songs in {json_file} to be searched on spotify")
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    progress = tqdm(total=n_songs, unit="song")
+    keyed = None
+    try:
+        for keyed in batches:
+            batch = [song for _, song in keyed]
+            # when resuming, songs found on a previous run aren't searched again
+            to_search = [s for s in batch if not (resume and "spotify" in s)]
+            n_skipped += len(batch) - len(to_search)
+
+            not_found = _search_batch(sp, executor, to_search, tiers, cache, tier_stats)
+            if not_found:
+                log_not_found(
+                    [f"{song['artist']} - {song['title']}" for song in not_found],
+                    not_found_file,
+                )
+
+            # save progress after each batch, so an interrupted run can be resumed
+            if store is not None:
+                store.update_many(keyed)
+            else:
+                dump_json_atomic(songs, json_file)
+            progress.update(len(batch))
+            keyed = None
+    finally:
+        # don't wait on queued searches if we were interrupted
+        executor.shutdown(cancel_futures=True)
+        progress.close()
+        if resume:
+            logger.info(f"Resumed: {n_skipped} songs already found")
+        for tier, stats in tier_stats.items():
+            if stats["searched"]:
+                log_tier_stats(tier, stats["searched"], stats["found"], stats["ms"])
+        if cache:
+            logger.info(f"Search cache: {cache.hits} hits, {cache.misses} misses")
+            cache.close()
+
+        # keep the matches of a batch we were interrupted part way through,
+        # every finished batch has been saved already
+        if store is not None:
+            if keyed:
+                store.update_many(keyed)
+            store.close()
+        elif keyed or not n_songs:
+            dump_json_atomic(songs, json_file)
+        logger.info(f"Updated {json_file} with spotify details")
 
+    return load_songs(json_file) if store is not None else songs
 
-def get_spotify_track_id(sp, json_file):
-    # read song names from json file
-    with open(json_file, "r", encoding="utf-8") as f:
-        songs = json.load(f)
 
-    # loop over song names and search for them on spotify
-    logger.info(f"Songs in {json_file} to be searched on spotify")
-    for song in tqdm(songs):
-        result = search_spotify_song(sp, song["artist"], song["title"])
-
-        if result:
-            song["spotify"] = {
-                "id": result["id"],
-                "artist": result["artist"],
-                "title": result["title"],
-                "url": result["url"],
-            }
-        else:
-            log_not_found(
-                f"{song['artist']} - {song['title']}",
-                Path(json_file).parent.joinpath(
-                    Path(json_file).stem + "-not_found.txt"
-                ),
+def _search_batch(sp, executor, songs, tiers, cache, tier_stats):
+    """
+    Search spotify for a batch of songs with each tier in turn, adding the
+    matches to the songs. Returns the songs that weren't found.
+    """
+    not_found = []
+    if cache:
+        pending = []
+        for song in songs:
+            cached, result = cache.get(
+                clean_artist(song["artist"]), clean_song_title(song["title"]), tiers
+            )
+            if not cached:
+                pending.append(song)
+            elif result:
+                update_song(song, result)
+            else:
+                not_found.append(song)
+        songs = pending
+
+    for tier in tiers:
+        if not songs:
+            break
+
+        # executor.map yields the results in the same order as the songs
+        results = executor.map(
+            lambda song: _timed_search(sp, song, QUERY_TIERS[tier]), songs
+        )
+        stats = tier_stats[tier]
+        misses = []
+        for song, (result, secs) in zip(songs, results):
+            # the tier doesn't apply to the song, so it wasn't searched
+            if secs is None:
+                misses.append(song)
+                continue
+            stats["searched"] += 1
+            stats["ms"][round(1000 * secs)] += 1
+            if result:
+                stats["found"] += 1
+                update_song(song, result)
+                if cache:
+                    cache.put(
+                        clean_artist(song["artist"]),
+                        clean_song_title(song["title"]),
+                        result,
+                    )
+            else:
+                misses.append(song)
+        songs = misses
+
+    # songs missed by every tier
+    if cache:
+        for song in songs:
+            cache.put(
+                clean_artist(song["artist"]),
+                clean_song_title(song["title"]),
+                None,
+                tiers,
             )
+    return not_found + songs
 
-    # update json file with spotify details
-    with open(json_file, "w", encoding="utf-8") as f:
-        json.dump(songs, f, indent=4)
-        logger.info(f"Updated {json_file} with spotify details")
 
-    return songs
+def _timed_search(sp, song, query):
+    """
+    Search for a song with a tier's query, returning the result and how long
+    the search took, or (None, None) if the query doesn't apply to the song.
+    """
+    if not _query_applies(song, query):
+        return None, None
+    start = time.perf_counter()
+    result = search_spotify_song(
+        sp,
+        song["artist"],
+        song["title"],
+        duration_ms=song.get("duration_ms"),
+        query=query,
+        artists=song.get("artists"),
+    )
+    return result, time.perf_counter() - start
 
 
-def search_spotify_song(sp, artist, title):
+def _query_applies(song, query):
+    # same cleaning as search_spotify_song, which is cached so costs nothing twice
+    try:
+        artist = clean_artist(song["artist"])
+        title = clean_song_title(song["title"])
+    except KeyError:
+        return False
+    return bool(query(artist, title, song["title"]))
+
+
+def log_tier_stats(tier, n_searched, n_found, latency_ms):
+    """
+    Log how a search tier did. latency_ms counts the searches by how long they
+    took in (whole) milliseconds, so it stays small however many songs there are.
+    """
+    n_timed = sum(latency_ms.values())
+    mean_ms = sum(ms * n for ms, n in latency_ms.items()) / max(n_timed, 1)
+    p95_ms = 0
+    below = 0
+    for ms, n in sorted(latency_ms.items()):
+        below += n
+        if below > 0.95 * (n_timed - 1):
+            p95_ms = ms
+            break
+    logger.info(
+        f"Search tier {tier}: {n_found}/{n_searched} found "
+        f"({n_found / max(n_searched, 1):.0%}), "
+        f"{mean_ms:.0f}ms mean, {p95_ms:.0f}ms p95 per search"
+    )
+
+
+def update_song(song, result):
+    song["spotify"] = {
+        "id": result["id"],
+        "artist": result["artist"],
+        "title": result["title"],
+        "url": result["url"],
+        "confidence": result.get("confidence"),
+    }
+
+
+def strict_query(artist, title, raw_title):
+    return f"{title} artist:{artist}"
+
+
+def remix_query(artist, title, raw_title):
+    # only worth searching if there's a bracketed mix name to keep
+    title_with_mix = clean_song_title(raw_title, keep_brackets=True)
+    if title_with_mix != title:
+        return f"{title_with_mix} artist:{artist}"
+
+
+def loose_query(artist, title, raw_title):
+    return f"{title} {artist}"
+
+
+def title_query(artist, title, raw_title):
+    return title
+
+
+# query builders for the search tiers, by name.
+# each takes the cleaned artist and title and the raw title and returns
+# the query string, or None if the tier doesn't apply to the song
+QUERY_TIERS = {
+    "strict": strict_query,
+    "remix": remix_query,
+    "loose": loose_query,
+    "title": title_query,
+}
+
+
+def search_spotify_song(
+    sp,
+    artist,
+    title,
+    duration_ms=None,
+    limit=SEARCH_CANDIDATES,
+    query=strict_query,
+    artists=None,
+):
+    """
+    Search spotify for a song, returning the best matching track or None.
+    With all the song's artists, the results are matched against all of them.
+    """
+    raw_title = title
     try:
         artist = clean_artist(artist)
         title = clean_song_title(title)
     except KeyError:
         return None
+    match_artist = " ".join(clean_artists(artists)) if artists else artist
 
     # build query search string
-    query = f"{title} artist:{artist}"
+    query = query(artist, title, raw_title)
     # query = urllib.parse.quote(query, safe=":")
-
-    try:
-        # we'll assume first result is correct and save its id
-        results = sp.search(q=query, limit=1, type="track")
-        result = results["tracks"]["items"][0]
-        logger.debug(result)
-    except IndexError:
+    if not query:
         return None
 
+    # score the top results and keep the best one, if its good enough
+    with metrics.timer("spotify.search"):
+        results = call_with_backoff(sp.search, q=query, limit=limit, type="track")
+    candidates = results["tracks"]["items"]
     try:
-        return {
-            "id": result["id"],
-            "artist": result["artists"][0]["name"],
-            "title": result["name"],
-            "url": SPOTIFY_TRACK_URL + result["id"],
-        }
+        result, score = best_match(match_artist, title, candidates, duration_ms)
     except Exception as e:
         logger.error(f"{type(e).__name__} - {e}")
         return None
+    logger.debug(f"{query}: {result} ({score:.0f})")
 
+    if result is None:
+        return None
 
-def create_spotify_playlist(sp, playlist_name, json_file):
+    return {
+        "id": result["id"],
+        "artist": result["artists"][0]["name"],
+        "title": result["name"],
+        "url": SPOTIFY_TRACK_URL + result["id"],
+        "confidence": round(score / 100, 2),
+    }
+
+
+def create_spotify_playlist(sp, playlist_name, json_file=None, songs=None):
+    """
+    Create a playlist of the songs found on spotify, either from json_file or
+    from songs, any iterable of song dicts (eg from get_spotify_track_id).
+    """
     # read song names from json file
-    with open(json_file, "r", encoding="utf-8") as f:
-        songs = json.load(f)
+    if songs is None:
+        songs = load_songs(json_file)
 
     # generate list of song_ids
-    song_ids = []
-    n_songs = 0
-    n_songs_spotify = 0
-    for song in songs:
-        n_songs += 1
-        if "spotify" in song:
-            n_songs_spotify += 1
-            if song["spotify"]["id"] not in song_ids:
-                song_ids.append(song["spotify"]["id"])
-    logger.info(f"no of songs {n_songs}")
-    logger.info(f"no of song_id's {n_songs_spotify}")
-    logger.info(f"no of unique song_id's {len(song_ids)}")
+    song_ids, counts = collect_track_ids(songs)
+    logger.info(f"no of songs {counts['songs']}")
+    logger.info(f"no of song_id's {counts['found']}")
+    logger.info(f"no of unique song_id's {counts['unique']}")
 
     # create a playlist for current user with provided name
     user_id = sp.me()["id"]
-    sp.user_playlist_create(user_id, playlist_name, public=False)
-
-    # find playlist's ID
-    # there may be multiple playlists with the given name, collect them to a list of tuples (name, id)
-    playlists = [
-        (x["name"], x["id"])
-        for x in sp.current_user_playlists()["items"]
-        if x["name"] == playlist_name
-    ]
+    playlist = sp.user_playlist_create(user_id, playlist_name, public=False)
 
     # add found songs to playlist
     logger.info("Adding songs to playlist...")
-    playlist_id = playlists[0][1]  # get the first playlist matching the name
-    batch_size = 10
-    for i in tqdm(range(0, len(song_ids), batch_size)):
-        batch = song_ids[i : i + batch_size]
-        time.sleep(1)
-        sp.playlist_add_items(playlist_id, batch)
+    add_tracks_to_playlist(sp, playlist["id"], song_ids)
+
+    return playlist["id"]
 
 
-def log_not_found(song, file):
+def sync_spotify_playlist(sp, playlist_id, json_file=None, songs=None):
+    """
+    Update an existing playlist (ID, URI or URL) to hold exactly the songs
+    found on spotify, from json_file or songs, adding and removing only the
+    tracks that differ.
+    """
+    if songs is None:
+        songs = load_songs(json_file)
+
+    song_ids, counts = collect_track_ids(songs)
+    logger.info(f"no of unique song_id's {counts['unique']}")
+
+    # compare against what's in the playlist now
+    limiter = TokenBucket()
+    in_playlist = get_playlist_track_ids(sp, playlist_id, limiter)
+    in_playlist_set = set(in_playlist)
+    song_ids_set = set(song_ids)
+    to_add = [id for id in song_ids if id not in in_playlist_set]
+    to_remove = list(dict.fromkeys(id for id in in_playlist if id not in song_ids_set))
+    logger.info(f"Syncing playlist: {len(to_add)} to add, {len(to_remove)} to remove")
+
+    for i in range(0, len(to_remove), PLAYLIST_BATCH_SIZE):
+        call_with_backoff(
+            sp.playlist_remove_all_occurrences_of_items,
+            playlist_id,
+            to_remove[i : i + PLAYLIST_BATCH_SIZE],
+            limiter=limiter,
+        )
+    add_tracks_to_playlist(sp, playlist_id, to_add, limiter=limiter)
+
+    return to_add, to_remove
+
+
+def collect_track_ids(songs):
+    """
+    Unique spotify track ids of songs, in order, in a single pass over songs.
+    Returns the ids and the counts of songs, songs found on spotify and unique ids.
+    """
+    track_ids = {}  # dicts keep insertion order, so this works as an ordered set
+    n_songs = 0
+    n_found = 0
+    for song in songs:
+        n_songs += 1
+        if "spotify" in song:
+            n_found += 1
+            track_ids[song["spotify"]["id"]] = None
+
+    counts = {"songs": n_songs, "found": n_found, "unique": len(track_ids)}
+    return list(track_ids), counts
+
+
+def add_tracks_to_playlist(
+    sp, playlist_id, track_ids, batch_size=PLAYLIST_BATCH_SIZE, limiter=None
+):
+    """Add tracks to a playlist in batches, paced by a TokenBucket rate limiter"""
+    from tqdm import tqdm
+
+    limiter = limiter or TokenBucket()
+    for i in tqdm(range(0, len(track_ids), batch_size)):
+        batch = track_ids[i : i + batch_size]
+        _add_batch(sp, playlist_id, batch, limiter)
+
+
+def _add_batch(sp, playlist_id, batch, limiter, max_retries=MAX_RETRIES):
+    from requests.exceptions import RequestException
+    from spotipy.exceptions import SpotifyException
+
+    for attempt in range(max_retries + 1):
+        try:
+            with metrics.timer("spotify.playlist_add_items"):
+                call_with_backoff(
+                    sp.playlist_add_items, playlist_id, batch, limiter=limiter
+                )
+            return
+        except (SpotifyException, RequestException) as e:
+            # 429s have already been retried, and other 4xx won't get any better,
+            # but the session giving up may have added the tracks like a 5xx
+            status = getattr(e, "http_status", 500)
+            ambiguous = status >= 500 or (
+                isinstance(e, SpotifyException) and session_gave_up(e)
+            )
+            if attempt == max_retries or not ambiguous:
+                raise
+            logger.warning(f"Adding tracks failed, retrying: {e}")
+            metrics.count("spotify.playlist_add_retries")
+
+            # the failed request may still have added the tracks,
+            # so only retry the ones that aren't in the playlist
+            in_playlist = set(get_playlist_track_ids(sp, playlist_id, limiter))
+            batch = [id for id in batch if id not in in_playlist]
+            if not batch:
+                return
+
+
+def get_playlist_track_ids(sp, playlist_id, limiter=None):
+    """
+    IDs of all the tracks in a playlist, leaving out local files and
+    unavailable tracks (which have no id)
+    """
+    response = call_with_backoff(
+        sp.playlist_items,
+        playlist_id,
+        fields="items(track(id)),next",
+        limit=100,
+        additional_types=["track"],
+        limiter=limiter,
+    )
+    return [
+        x["track"]["id"]
+        for x in iter_items(sp, response, limiter)
+        if x["track"] and x["track"]["id"]
+    ]
+
+
+def log_not_found(songs, file):
     with open(file, "a", encoding="utf-8") as f:
-        f.write(song + "\n")
+        f.writelines(song + "\n" for song in songs)
+
+
+class LazySpotify:
+    """
+    Stands in for the spotipy client, only connecting to spotify the first
+    time one of its attributes is used. So commands that never make a spotify
+    call don't need the credentials, a login, or spotipy to be imported.
+    """
+
+    def __init__(self, connect=None):
+        self._connect = connect or spotify_connect
+        self._sp = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # only called for attributes LazySpotify doesn't have itself
+        with self._lock:
+            if self._sp is None:
+                self._sp = self._connect()
+        return getattr(self._sp, name)
 
 
 def spotify_connect():
@@ -170,6 +553,9 @@ def spotify_connect():
     Connect to spotify.
     Register app to get tokens first at: https://developer.spotify.com/dashboard/
     """
+    # spotipy is slow to import, so its only loaded to connect
+    import spotipy
+    from spotipy.oauth2 import SpotifyOAuth
 
     if not os.path.exists(CREDENTIALS):
         generate_credentials_json()
@@ -190,10 +576,39 @@ def spotify_connect():
             client_secret=client_secret,
             redirect_uri=redirect_uri,
             scope=scope,
-        )
+        ),
+        requests_session=spotify_session(),
     )
 
 
+def spotify_session(retries=SESSION_RETRIES):
+    """
+    requests session for the spotipy client, retrying connection errors and
+    5xx responses but not 429s, or 5xx responses to POSTs (adding tracks).
+    urllib3 retries a 429 that has a Retry-After header by itself (and spotipy
+    turns running out of those retries into a 429 without the header), so its
+    turned off here to let 429s through to call_with_backoff.
+    """
+    import requests
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        status=retries,
+        allowed_methods=SESSION_RETRY_METHODS,
+        backoff_factor=0.3,
+        status_forcelist=STATUS_FORCELIST,
+        respect_retry_after_header=False,
+    )
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def generate_credentials_json():
     print("\n")
     print("To connect to spotify we require some tokens")
@@ -215,65 +630,118 @@ def generate_credentials_json():
     print("\nSaved to", CREDENTIALS)
 
 
-def get_liked_songs(sp, csv_out="data/liked_songs.csv"):
-    # get the songs
-    batch_size = 50  # 50 is the most spotify will return at a time
-    counter = 0
-
-    with open(csv_out, "w", encoding="utf-8") as f:
-        csv_writer = csv.writer(f, delimiter="\t")
-        csv_writer.writerow(["Num", "Title", "Artists", "TrackID", "URL"])
-
-    if sp:
-        for i in range(0, 10000000, batch_size):
-            response = sp.current_user_saved_tracks(offset=i, limit=batch_size)
-            if len(response["items"]) == 0:
-                break
-
-            for item in response["items"]:
-                counter += 1
-                add_track_data_to_csv(item, counter, csv_out)
-        logger.info(f"Generated liked songs file: {csv_out}")
+def get_liked_songs(sp, out_file=None, fmt=EXPORT_FORMAT, workers=PREFETCH_WORKERS):
+    out_file = out_file or f"data/liked_songs.{fmt}"
+    items = iter_items_prefetch(sp.current_user_saved_tracks, workers)
+    n_tracks = export_tracks(items, out_file, fmt)
+    logger.info(f"Generated liked songs file: {out_file} ({n_tracks} tracks)")
 
 
-def get_playlist_items(sp, url, csv_out=None):
-    batch_size = 50  # 50 is the most spotify will return at a time
-    counter = 0
-
-    if not csv_out:
+def get_playlist_items(
+    sp, url, out_file=None, fmt=EXPORT_FORMAT, workers=PREFETCH_WORKERS
+):
+    if not out_file:
         try:
-            csv_out = (
-                "data/" + PurePosixPath(unquote(urlparse(url).path)).parts[2] + ".csv"
+            out_file = (
+                "data/" + PurePosixPath(unquote(urlparse(url).path)).parts[2] + f".{fmt}"
             )
         except:
-            csv_out = "data/playlist.csv"
+            out_file = f"data/playlist.{fmt}"
 
-    with open(csv_out, "w", encoding="utf-8") as f:
-        csv_writer = csv.writer(f, delimiter="\t")
-        csv_writer.writerow(["Num", "Title", "Artists", "TrackID", "URL"])
+    items = iter_items_prefetch(partial(sp.playlist_items, url), workers)
+    n_tracks = export_tracks(items, out_file, fmt)
+    logger.info(f"Generated playlist file: {out_file} ({n_tracks} tracks)")
 
-    if sp:
-        for i in range(0, 10000000, batch_size):
-            response = sp.playlist_items(url, offset=i, limit=batch_size)
-            if len(response["items"]) == 0:
-                break
 
-            for item in response["items"]:
-                counter += 1
-                add_track_data_to_csv(item, counter, csv_out)
+def iter_items(sp, response, limiter=None):
+    """Yield the items of a paged spotify response, following its next links"""
+    while response:
+        yield from response["items"]
+        if response["next"]:
+            response = call_with_backoff(sp.next, response, limiter=limiter)
+        else:
+            response = None
 
 
-def add_track_data_to_csv(item, track_num, csv_file):
-    track_id = "" if not item["track"]["id"] else item["track"]["id"]
+def iter_items_prefetch(fetch, workers=PREFETCH_WORKERS, page_size=PAGE_SIZE):
+    """
+    Yield the items of a paged spotify endpoint, fetch(offset=..., limit=...), in order.
+    The first response gives the total, so the offsets of all the other pages
+    are known up front and they are fetched `workers` at a time, paced by a
+    TokenBucket rate limiter.
+    """
+    limiter = TokenBucket()
+    first = call_with_backoff(fetch, offset=0, limit=page_size, limiter=limiter)
+    yield from first["items"]
 
-    track_info = [
-        track_num,
-        item["track"]["name"],
-        ", ".join([a["name"] for a in item["track"]["artists"]]),
-        track_id,
-        SPOTIFY_TRACK_URL + track_id,
-    ]
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        pages = executor.map(
+            lambda offset: call_with_backoff(
+                fetch, offset=offset, limit=page_size, limiter=limiter
+            ),
+            range(page_size, first["total"], page_size),
+        )
+        for page in pages:
+            yield from page["items"]
+    finally:
+        executor.shutdown(cancel_futures=True)
 
-    with open(csv_file, "a", encoding="utf-8") as f:
-        csv_writer = csv.writer(f, delimiter="\t")
-        csv_writer.writerow(track_info)
+
+def export_tracks(items, out_file, fmt=EXPORT_FORMAT):
+    """
+    Write track rows for the playlist/saved track items to out_file, as they
+    come in, through a single writer.
+    fmt is one of EXPORT_FORMATS: tab delimited csv, jsonl, or parquet (needs pyarrow).
+    Returns the number of tracks written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt}, expected one of {EXPORT_FORMATS}")
+    rows = (track_row(item, num) for num, item in enumerate(items, 1))
+
+    if fmt == "parquet":
+        return _write_parquet(rows, out_file)
+
+    n_tracks = 0
+    with open(out_file, "w", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=TRACK_FIELDS, delimiter="\t")
+            writer.writeheader()
+        for row in rows:
+            with metrics.timer("write.export"):
+                if fmt == "csv":
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            n_tracks += 1
+    return n_tracks
+
+
+def _write_parquet(rows, out_file):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("parquet export needs pyarrow, install it with: pip install pyarrow")
+
+    # collect the rows as columns
+    columns = {field: [] for field in TRACK_FIELDS}
+    for row in rows:
+        for field, value in row.items():
+            columns[field].append(value)
+
+    pyarrow.parquet.write_table(pyarrow.table(columns), out_file)
+    return len(columns["Num"])
+
+
+def track_row(item, track_num):
+    track = item["track"] or {}
+    track_id = track.get("id") or ""
+
+    return {
+        "Num": track_num,
+        "Title": track.get("name"),
+        "Artists": ", ".join([a["name"] for a in track.get("artists", [])]),
+        "TrackID": track_id,
+        "URL": SPOTIFY_TRACK_URL + track_id,
+    }
@@ -0,0 +1,52 @@
+import sqlite3
+import time
+from .cache import SearchCache
+
+
+def test_miss_ttl(tmp_path):
+    with SearchCache(tmp_path / "cache.sqlite", miss_ttl=0.05) as cache:
+        cache.put("nobody", "missing song", None)
+        assert cache.get("nobody", "missing song") == (True, None)
+        time.sleep(0.1)
+        assert cache.get("nobody", "missing song") == (False, None)
+        assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction(tmp_path):
+    db_file = tmp_path / "cache.sqlite"
+    with SearchCache(db_file, max_entries=2) as cache:
+        for title in ["a", "b", "c"]:
+            cache.put("artist", title, {"id": title})
+            time.sleep(0.01)
+        cache.get("artist", "a")
+
+    with SearchCache(db_file) as cache:
+        assert cache.get("artist", "a") == (True, {"id": "a"})
+        assert cache.get("artist", "b") == (False, None)
+        assert cache.get("artist", "c") == (True, {"id": "c"})
+
+
+def test_miss_tiers(tmp_path):
+    with SearchCache(tmp_path / "cache.sqlite") as cache:
+        cache.put("nobody", "missing song", None, ["strict", "loose"])
+        assert cache.get("nobody", "missing song", ["loose"]) == (True, None)
+        assert cache.get("nobody", "missing song", ["strict", "title"]) == (False, None)
+
+
+def test_adds_tiers_to_old_cache(tmp_path):
+    db_file = tmp_path / "cache.sqlite"
+    con = sqlite3.connect(db_file)
+    con.execute(
+        "CREATE TABLE searches (artist TEXT NOT NULL, title TEXT NOT NULL, "
+        "result TEXT, created REAL NOT NULL, last_used REAL NOT NULL, "
+        "PRIMARY KEY (artist, title))"
+    )
+    con.execute("INSERT INTO searches VALUES ('nobody', 'missing song', NULL, 0, 0)")
+    con.commit()
+    con.close()
+
+    with SearchCache(db_file, miss_ttl=float("inf")) as cache:
+        # old misses don't know their tiers, so they're searched again
+        assert cache.get("nobody", "missing song", ["strict"]) == (False, None)
+        cache.put("artist", "a", {"id": "a"})
+        assert cache.get("artist", "a", ["strict"]) == (True, {"id": "a"})
@@ -0,0 +1,248 @@
+import eyed3
+import json
+import pytest
+from .genres import (
+    ArtistGenreMapper,
+    apply_tag_plan,
+    GenreMapper,
+    artist_genre_mapper,
+    clean_tags,
+    get_spotify_genres_from_song_archive,
+    genre_mapper,
+    map_genre,
+)
+from .metrics import metrics
+from .test_scanner import CORRUPT_ID3V22, make_mp3
+
+GENRES = {
+    "house": "house",
+    "deep house": "house",
+    "tech house": "house",
+    "techno": "techno",
+    "minimal techno": "techno",
+    "trance": "trance",
+    "hip hop": "hip-hop",
+    "top 40": "pop",
+}
+
+
+@pytest.fixture
+def genres_json(tmp_path):
+    file = tmp_path / "genres.json"
+    file.write_text(json.dumps(GENRES), encoding="utf-8")
+    yield str(file)
+    genre_mapper.cache_clear()
+
+
+def test_map_genre(genres_json):
+    assert map_genre("Deep House", genres_json) == "house"
+    assert map_genre("Deep-House ", genres_json) == "house"
+    assert map_genre("Minimal Techno 2", genres_json) == "techno"
+    assert map_genre("Hip-Hop", genres_json) == "hip-hop"
+    assert map_genre("polka", genres_json) is None
+    assert map_genre(None, genres_json) is None
+
+
+def test_genre_mapper_loads_json_once(genres_json, monkeypatch):
+    mapper = genre_mapper(genres_json)
+    monkeypatch.setattr("builtins.open", None)
+
+    assert genre_mapper(genres_json) is mapper
+    assert map_genre("techno", genres_json) == "techno"
+    assert mapper.map("Deep House") == mapper.map("Deep House")
+    assert mapper.map.cache_info().hits == 1
+
+
+@pytest.fixture
+def artist_genres_csv(tmp_path, genres_json):
+    file = tmp_path / "artist_genres.csv"
+    file.write_text(
+        "artist_id|artist|genres\n"
+        "1|Daft Punk|['house', 'deep house', 'techno']\n"
+        "2|Armin van Buuren|['trance']\n"
+        "3|Nobody|[]\n",
+        encoding="utf-8",
+    )
+    yield str(file)
+    artist_genre_mapper.cache_clear()
+
+
+def test_map_artist_genre(artist_genres_csv, genres_json):
+    mapper = ArtistGenreMapper(artist_genres_csv, genres_json)
+
+    assert mapper.map("daft punk") == "house"
+    assert mapper.map("armin van buren") == "trance"
+    assert mapper.map("nobody") is None
+    assert mapper.map("someone else") is None
+    assert mapper.map("daft punk") == "house"
+    assert mapper.map.cache_info().hits == 1
+
+
+def test_map_many_matches_map(artist_genres_csv, genres_json):
+    genres = ["Deep-House ", "techno", "Minimal Techno 2", "Hip-Hop", "polka", "techno"]
+    mapper = GenreMapper(genres_json)
+    assert mapper.map_many(genres) == {g: mapper.map(g) for g in genres}
+
+    artists = ["daft punk", "armin van buren", "nobody", "someone else"]
+    mapper = ArtistGenreMapper(artist_genres_csv, genres_json)
+    assert mapper.map_many(artists) == {a: mapper.map(a) for a in artists}
+
+
+def test_artist_genre_vote(artist_genres_csv, genres_json):
+    mapper = ArtistGenreMapper(artist_genres_csv, genres_json)
+
+    # two of daft punk's three genres map to house
+    genre, confidence = mapper.vote("daft punk")
+    assert genre == "house"
+    assert confidence == pytest.approx(2 / 3)
+    # a fuzzy artist match is less confident
+    assert mapper.vote("armin van buren")[1] < 1
+    assert mapper.vote("nobody") == (None, 0.0)
+
+    artists = ["daft punk", "armin van buren", "nobody", "someone else"]
+    votes = mapper.vote_many(artists)
+    assert votes == {a: pytest.approx(mapper.vote(a)) for a in artists}
+
+
+def test_clean_tags_workers(tmp_path, genres_json, monkeypatch):
+    monkeypatch.setattr("mltk.genres.genre_mapper", lambda: GenreMapper(genres_json))
+    for i, genre in enumerate(["Deep-House", "techno", "Minimal Techno"]):
+        make_mp3(tmp_path / f"{i}.mp3", "Beyoncé", "Halo")
+        audio = eyed3.load(tmp_path / f"{i}.mp3")
+        audio.tag.genre = genre
+        audio.tag.save()
+    (tmp_path / "broken.mp3").write_bytes(b"not an mp3")
+
+    counts = clean_tags(tmp_path, workers=2)
+
+    assert counts == {"changed": 3, "failed": 1}
+    assert [eyed3.load(tmp_path / f"{i}.mp3").tag.genre.name for i in range(3)] == [
+        "House",
+        "Techno",
+        "Techno",
+    ]
+    assert eyed3.load(tmp_path / "0.mp3").tag.artist == "Beyonce"
+
+
+def test_clean_tags_corrupt_file(tmp_path, genres_json, monkeypatch):
+    monkeypatch.setattr("mltk.genres.genre_mapper", lambda: GenreMapper(genres_json))
+    make_mp3(tmp_path / "0.mp3", "Beyoncé", "Halo")
+    (tmp_path / "1.mp3").write_bytes(CORRUPT_ID3V22)
+
+    # the file that can't be read is reported, not the end of the run
+    for index_file in [None, tmp_path / "library.sqlite"]:
+        counts = clean_tags(tmp_path, index_file=index_file)
+        assert counts["failed"] == 1
+
+
+def test_clean_tags_workers_metrics(tmp_path, genres_json, monkeypatch):
+    monkeypatch.setattr("mltk.genres.genre_mapper", lambda: GenreMapper(genres_json))
+    for i in range(40):
+        make_mp3(tmp_path / f"{i}.mp3", "Beyoncé", "Halo")
+
+    metrics.enable()
+    try:
+        clean_tags(tmp_path, workers=2)
+        summary = metrics.summary()
+    finally:
+        metrics.enabled = False
+        metrics.reset()
+
+    # the saves happen in the worker processes, merged back into the parent
+    assert summary["timers"]["eyed3.save"]["calls"] == 40
+
+
+def test_clean_tags_artist_with_newline(
+    tmp_path, artist_genres_csv, genres_json, monkeypatch
+):
+    mapper = ArtistGenreMapper(artist_genres_csv, genres_json)
+    monkeypatch.setattr("mltk.genres.artist_genre_mapper", lambda *args: mapper)
+    # a multi-value artist tag
+    for i, artist in enumerate(["Daft Punk", "Daft Punk\nThomas Bangalter"]):
+        make_mp3(tmp_path / f"{i}.mp3", artist, "One More Time")
+        audio = eyed3.load(tmp_path / f"{i}.mp3")
+        audio.tag.genre = "Electronic"
+        audio.tag.save()
+
+    # cleaned like any other artist, rather than failing the whole batch
+    counts = clean_tags(tmp_path, use_artist_genre=True)
+
+    assert "failed" not in counts and sum(counts.values()) == 2
+    assert eyed3.load(tmp_path / "0.mp3").tag.genre.name == "House"
+
+
+def test_clean_tags_plan_then_apply(tmp_path, genres_json, monkeypatch):
+    monkeypatch.setattr("mltk.genres.genre_mapper", lambda: GenreMapper(genres_json))
+    mp3 = make_mp3(tmp_path / "0.mp3", "Beyoncé", "Halo")
+    make_mp3(tmp_path / "1.mp3", "Daft Punk", "One More Time")
+    audio = eyed3.load(mp3)
+    audio.tag.genre = "Deep-House"
+    audio.tag.save()
+    plan_file = tmp_path / "plan.jsonl"
+
+    counts = clean_tags(tmp_path, plan_file=plan_file)
+
+    assert counts == {"changed": 1, "unchanged": 1}
+    assert eyed3.load(mp3).tag.artist == "Beyoncé"
+    plans = [json.loads(line) for line in plan_file.read_text(encoding="utf-8").splitlines()]
+    assert plans == [
+        {
+            "path": mp3,
+            "status": "changed",
+            "changes": {
+                "artist": ["Beyoncé", "Beyonce"],
+                "genre": ["Deep-House", "house"],
+                "genre_comment": [None, "Deep-House"],
+            },
+            "rewrite": False,
+        }
+    ]
+
+    assert apply_tag_plan(plan_file) == {"changed": 1}
+    audio = eyed3.load(mp3)
+    assert (audio.tag.artist, audio.tag.genre.name) == ("Beyonce", "House")
+    assert audio.tag.comments.get("genre").text == "Deep-House"
+    assert apply_tag_plan(plan_file) == {"unchanged": 1}
+
+
+class FakeArchiveSpotify:
+    def __init__(self):
+        self.calls = []
+
+    def tracks(self, tracks):
+        self.calls.append(("tracks", len(tracks)))
+        return {
+            "tracks": [{"artists": [{"id": f"a{int(t[1:]) % 60}"}]} for t in tracks]
+        }
+
+    def artists(self, artists):
+        self.calls.append(("artists", len(artists)))
+        return {
+            "artists": [
+                {"id": a, "name": f"name {a}", "genres": ["house"]} for a in artists
+            ]
+        }
+
+
+def test_get_spotify_genres_from_song_archive(tmp_path):
+    archive = tmp_path / "archive"
+    lines = [f"t{i}\t0\tartist {i % 60}\tsong\n" for i in range(120)]
+    archive.write_text("".join(lines + lines[:10]), encoding="utf-8")
+    csv_file = tmp_path / "artist_genres.csv"
+    csv_file.write_text(
+        "artist_id|artist|genres\na0|artist 0|['disco']\n", encoding="utf-8"
+    )
+    sp = FakeArchiveSpotify()
+
+    get_spotify_genres_from_song_archive(archive, csv_file, sp=sp)
+
+    assert sp.calls == [
+        ("tracks", 50),
+        ("tracks", 50),
+        ("tracks", 18),
+        ("artists", 50),
+        ("artists", 9),
+    ]
+    rows = csv_file.read_text(encoding="utf-8").splitlines()
+    assert len(rows) == 2 + 59
+    assert rows[2] == "a1|name a1|['house']"
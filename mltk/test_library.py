@@ -0,0 +1,30 @@
+import os
+from .library import LibraryIndex
+from .test_scanner import make_mp3
+
+
+def test_rescan_only_parses_changed_files(tmp_path, monkeypatch):
+    music = tmp_path / "music"
+    for i in range(3):
+        make_mp3(music / f"{i}.mp3", f"artist {i}", f"song {i}")
+
+    with LibraryIndex(tmp_path / "library.sqlite") as index:
+        rows = index.scan(music)
+        assert [r["artist"] for r in rows] == ["artist 0", "artist 1", "artist 2"]
+        assert rows[0]["genre"] == "House"
+
+        # retag one file, delete another
+        make_mp3(music / "1.mp3", "new artist", "song 1")
+        st = os.stat(music / "1.mp3")
+        os.utime(music / "1.mp3", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        os.remove(music / "2.mp3")
+
+        parsed = []
+        monkeypatch.setattr(
+            "mltk.library.scan_tags",
+            lambda paths, *args: parsed.extend(paths) or [],
+        )
+        rows = index.scan(music)
+
+    assert parsed == [str(music / "1.mp3")]
+    assert [r["path"] for r in rows] == [str(music / "0.mp3"), str(music / "1.mp3")]
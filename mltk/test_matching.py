@@ -0,0 +1,40 @@
+from .matching import best_match
+
+
+def track(id, title, artists, duration_ms=200000):
+    return {
+        "id": id,
+        "name": title,
+        "artists": [{"name": a} for a in artists],
+        "duration_ms": duration_ms,
+    }
+
+
+def test_best_match_prefers_closest_candidate():
+    candidates = [
+        track("cover", "One More Time", ["Some Tribute Band"]),
+        track("remix", "One More Time - Club Mix", ["Daft Punk"]),
+        track("original", "One More Time", ["Daft Punk", "Romanthony"]),
+    ]
+
+    result, score = best_match("daft punk", "one more time", candidates)
+
+    assert result["id"] == "original"
+    assert score == 100
+
+
+def test_best_match_uses_duration():
+    candidates = [
+        track("radio", "Strobe", ["deadmau5"], duration_ms=215000),
+        track("album", "Strobe", ["deadmau5"], duration_ms=637000),
+    ]
+
+    assert best_match("deadmau5", "strobe", candidates)[0]["id"] == "radio"
+    assert best_match("deadmau5", "strobe", candidates, 636000)[0]["id"] == "album"
+
+
+def test_best_match_threshold():
+    candidates = [track("wrong", "Something Else Entirely", ["Another Artist"])]
+
+    assert best_match("daft punk", "one more time", candidates)[0] is None
+    assert best_match("daft punk", "one more time", []) == (None, 0.0)
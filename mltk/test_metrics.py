@@ -0,0 +1,75 @@
+import json
+
+from .metrics import *
+from .spotiply import search_spotify_song
+from .test_spotiply import StubSpotify
+
+
+def test_disabled_records_nothing():
+    m = Metrics()
+    with m.timer("load"):
+        pass
+    m.count("retries")
+
+    assert m.summary() == {"wall_s": 0, "timers": {}, "counters": {}}
+
+
+def test_summary(tmp_path):
+    m = Metrics()
+    m.enable()
+    for ms in range(1, 101):
+        m.record("search", ms / 1000)
+    m.count("retries")
+    m.count("retries")
+    m.count("backoff_seconds", 1.5)
+
+    @m.timed("load")
+    def load():
+        return "loaded"
+
+    assert load() == "loaded"
+
+    out_file = tmp_path / "metrics.json"
+    m.write_summary(out_file)
+    summary = json.loads(out_file.read_text(encoding="utf-8"))
+
+    search = summary["timers"]["search"]
+    assert search["calls"] == 100
+    assert search["p50_ms"] == 50
+    assert search["p95_ms"] == 95
+    assert search["max_ms"] == 100
+    assert summary["timers"]["load"]["calls"] == 1
+    assert summary["counters"] == {"backoff_seconds": 1.5, "retries": 2}
+
+
+def test_take_and_merge():
+    worker = Metrics()
+    worker.start_worker(True)
+    worker.record("eyed3.load", 0.01)
+    worker.count("retries")
+    taken = worker.take()
+
+    assert worker.take() is None
+    m = Metrics()
+    m.enable()
+    m.record("eyed3.load", 0.02)
+    m.merge(taken)
+    m.merge(None)
+
+    summary = m.summary()
+    assert summary["timers"]["eyed3.load"]["calls"] == 2
+    assert summary["counters"] == {"retries": 1}
+
+
+def test_spotify_calls_are_counted():
+    metrics.enable()
+    try:
+        sp = StubSpotify(latency=0, rate_limited=2)
+        search_spotify_song(sp, "Daft Punk", "One More Time")
+        summary = metrics.summary()
+    finally:
+        metrics.enabled = False
+        metrics.reset()
+
+    assert summary["timers"]["spotify.search"]["calls"] == 1
+    assert summary["counters"]["spotify.retries"] == 2
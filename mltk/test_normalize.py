@@ -0,0 +1,32 @@
+from .normalize import *
+
+
+def test_remove_accents():
+    assert remove_accents("Beyoncé") == "Beyonce"
+    assert remove_accents("Röyksopp") == "Royksopp"
+    assert remove_accents("plain") == "plain"
+
+
+def test_clean_artist_first_separator():
+    assert clean_artist("A vs B feat C") == "a"
+    assert clean_artist("Disclosure ft. Sam Smith") == "disclosure ft sam smith"
+    assert clean_artist("") is None
+
+
+def test_batch_matches_single():
+    titles = ["One More Time (Radio Edit)", "Strobe [Club Mix]", None, "Strobe [Club Mix]"]
+    assert clean_song_titles(titles) == [clean_song_title(t) for t in titles]
+    assert clean_song_titles(titles, keep_brackets=True)[1] == "strobe club mix"
+
+    artists = ["Jay-Z & Kanye", "Kanye feat Jay-Z", "Sigur Rós"]
+    assert clean_artists(artists) == ["jayz", "kanye", "sigur rs"]
+    assert remove_accents_many(artists)[2] == "Sigur Ros"
+
+
+def test_batch_newlines():
+    assert clean_artists([]) == []
+    # a multi-value tag doesn't throw the rest of the batch out
+    artists = ["Daft Punk", "Daft Punk\nJulian Casablancas", "Justice"]
+    assert clean_artists(artists) == [clean_artist(a) for a in artists]
+    titles = ["Strobe (Club Mix)", "One\nTwo (Edit)"]
+    assert clean_song_titles(titles) == [clean_song_title(t) for t in titles]
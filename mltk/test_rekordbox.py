@@ -0,0 +1,78 @@
+import json
+import tracemalloc
+from .rekordbox import *
+from .spotiply import rbox_to_json
+
+TXT = (
+    "#\tArtist\tTrack Title\tTime\n"
+    "1\tDaft Punk, Pharrell Williams\tGet Lucky\t06:09\n"
+    "2\tArmin van Buuren\tBlah Blah Blah\t\n"
+)
+
+
+def write_xml(file, n_tracks):
+    with open(file, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<DJ_PLAYLISTS Version="1.0.0">\n<COLLECTION Entries="{n_tracks}">\n')
+        for i in range(n_tracks):
+            f.write(
+                f'<TRACK TrackID="{i}" Name="Song {i}" Artist="Artist {i}, Guest {i}"'
+                f' TotalTime="{200 + i % 100}">'
+                '<TEMPO Inizio="0.0" Bpm="124.00"/></TRACK>\n'
+            )
+        f.write("</COLLECTION>\n<PLAYLISTS>\n")
+        f.write('<NODE Type="0" Name="ROOT"><NODE Name="p" Type="1" Entries="1">')
+        f.write('<TRACK Key="0"/></NODE></NODE>\n</PLAYLISTS>\n</DJ_PLAYLISTS>\n')
+
+
+def test_iter_rekordbox_txt(tmp_path):
+    txt_file = tmp_path / "playlist.txt"
+    txt_file.write_text(TXT, encoding="utf-16")
+
+    assert list(iter_rekordbox(txt_file)) == [
+        {
+            "artist": "Daft Punk",
+            "title": "Get Lucky",
+            "artists": ["Daft Punk", "Pharrell Williams"],
+            "duration_ms": 369000,
+        },
+        {"artist": "Armin van Buuren", "title": "Blah Blah Blah"},
+    ]
+
+
+def test_iter_rekordbox_xml(tmp_path):
+    xml_file = tmp_path / "collection.xml"
+    write_xml(xml_file, 3)
+
+    songs = list(iter_rekordbox(xml_file))
+    assert len(songs) == 3  # and not the playlist's track
+    assert songs[1] == {
+        "artist": "Artist 1",
+        "title": "Song 1",
+        "artists": ["Artist 1", "Guest 1"],
+        "duration_ms": 201000,
+    }
+
+
+def test_iter_rekordbox_xml_memory_is_flat(tmp_path):
+    def peak_memory(n_tracks):
+        xml_file = tmp_path / f"collection{n_tracks}.xml"
+        write_xml(xml_file, n_tracks)
+        tracemalloc.start()
+        for _ in iter_rekordbox_xml(xml_file):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    assert peak_memory(20000) < 2 * peak_memory(2000)
+
+
+def test_rbox_to_json(tmp_path):
+    txt_file = tmp_path / "playlist.txt"
+    txt_file.write_text(TXT, encoding="utf-16")
+    json_file = tmp_path / "playlist.json"
+
+    assert rbox_to_json(txt_file, json_file) == 2
+    songs = json.loads(json_file.read_text(encoding="utf-8"))
+    assert songs == list(iter_rekordbox(txt_file))
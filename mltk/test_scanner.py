@@ -0,0 +1,86 @@
+import eyed3
+import json
+from eyed3.id3 import ID3_V1_1, ID3_V2_3, ID3_V2_4, Tag
+from .scanner import list_mp3s, read_tags, scan_tags
+from .spotiply import music_dir_to_json
+
+# an ID3v2.2 tag eyed3 fails to parse
+CORRUPT_ID3V22 = (
+    b"ID3\x02\x00@\x00\x00\x000\xc9WVt\x06fv\xcf\xb0\xb4\xeb\x89\x02\xc4Bi\xda"
+    b"\x1c\xf6\xbaf\xd3\xf8\xb6"
+)
+
+
+def make_mp3(file, artist, title, version=ID3_V2_4):
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_bytes(b"\xff\xfb\x90\x00" + bytes(413))
+    tag = Tag()
+    tag.artist = artist
+    tag.title = title
+    tag.genre = "House"
+    tag.save(str(file), version=version)
+    return str(file)
+
+
+def test_read_tags_matches_eyed3(tmp_path):
+    for i, version in enumerate([ID3_V2_3, ID3_V2_4, ID3_V1_1]):
+        mp3 = make_mp3(tmp_path / f"{i}.mp3", "Beyonce", "Halo (Remix)", version)
+        audio = eyed3.load(mp3)
+
+        assert read_tags(mp3) == {
+            "artist": audio.tag.artist,
+            "title": audio.tag.title,
+            "duration_ms": None,
+        }
+        assert read_tags(mp3, {"TCON": "genre"}) == {"genre": "House"}
+
+
+def test_read_tags_without_tag(tmp_path):
+    mp3 = tmp_path / "untagged.mp3"
+    mp3.write_bytes(b"\xff\xfb\x90\x00" + bytes(413))
+
+    assert read_tags(str(mp3)) == {"artist": None, "title": None, "duration_ms": None}
+
+
+def test_read_tags_truncated_tag(tmp_path):
+    mp3 = tmp_path / "partial.mp3"
+    # the header claims a 1000 byte tag, the file ends after one frame
+    title = b"TIT2" + (6).to_bytes(4, "big") + b"\x00\x00" + b"\x03Halo\x00"
+    for version in (3, 4):
+        mp3.write_bytes(b"ID3" + bytes([version, 0, 0, 0, 0, 7, 104]) + title)
+
+        assert read_tags(str(mp3)) == {
+            "artist": None,
+            "title": "Halo",
+            "duration_ms": None,
+        }
+
+
+def test_read_tags_corrupt_tag(tmp_path):
+    mp3 = tmp_path / "corrupt.mp3"
+    mp3.write_bytes(CORRUPT_ID3V22)
+
+    assert read_tags(str(mp3)) == {"artist": None, "title": None, "duration_ms": None}
+
+
+def test_scan_tags_parallel_keeps_order(tmp_path):
+    paths = [make_mp3(tmp_path / f"{i:03d}.mp3", f"artist {i}", "song") for i in range(100)]
+
+    tags = list(scan_tags(paths, workers=2))
+
+    assert [t["artist"] for t in tags] == [f"artist {i}" for i in range(100)]
+
+
+def test_music_dir_to_json_recursive(tmp_path):
+    make_mp3(tmp_path / "b.mp3", "Daft Punk", "One More Time")
+    make_mp3(tmp_path / "sub" / "a.mp3", "Kanye", "Stronger")
+    out_file = tmp_path / "songs.json"
+
+    assert len(list_mp3s(tmp_path)) == 1
+    assert music_dir_to_json(tmp_path, out_file, recursive=True) == 2
+
+    songs = [
+        {"artist": "Daft Punk", "title": "One More Time"},
+        {"artist": "Kanye", "title": "Stronger"},
+    ]
+    assert out_file.read_text(encoding="utf-8") == json.dumps(songs, indent=4)
@@ -0,0 +1,120 @@
+import json
+import tracemalloc
+from .songstore import *
+from .spotiply import get_spotify_track_id
+from .test_spotiply import CrashingSpotify, StubSpotify, make_songs_json
+
+
+def test_song_store_keeps_order_and_keys(tmp_path):
+    songs = [
+        {"artist": "A", "title": "One"},
+        {"artist": "B", "title": "Two"},
+        {"artist": "A", "title": "One"},
+    ]
+    with SongStore(tmp_path / "songs.sqlite") as store:
+        store.replace(songs)
+        (keyed,) = store.batches()
+        stored = list(store)
+
+    assert [key for key, _ in keyed] == ["a - one", "b - two", "a - one#2"]
+    # the keys stay in the store, out of the songs
+    assert stored == songs
+    assert [song for _, song in keyed] == songs
+    assert all("key" not in song for song in songs)
+
+
+def test_song_store_keys_dont_clash(tmp_path):
+    songs = [
+        {"artist": "a", "title": "b"},
+        {"artist": "a", "title": "b"},
+        {"artist": "a", "title": "b#2"},
+        {"artist": "a", "title": "b"},
+    ]
+    with SongStore(tmp_path / "songs.sqlite") as store:
+        assert store.replace(songs) == 4
+        assert len(store) == 4
+        (keyed,) = store.batches()
+
+    assert [key for key, _ in keyed] == ["a - b", "a - b#2", "a - b#2#2", "a - b#3"]
+    assert [song for _, song in keyed] == songs
+
+
+def test_song_store_update(tmp_path):
+    with SongStore(tmp_path / "songs.sqlite") as store:
+        store.replace({"artist": f"a{i}", "title": "t"} for i in range(3))
+        key, song = next(store.batches())[1]
+        song["spotify"] = {"id": "x"}
+        store.update(key, song)
+
+        assert [s.get("spotify") for s in store] == [None, {"id": "x"}, None]
+        assert len(store) == 3
+
+
+def test_convert_songs_round_trip(tmp_path):
+    json_file = make_songs_json(tmp_path, 3)
+    convert_songs(json_file, tmp_path / "songs.sqlite")
+    convert_songs(tmp_path / "songs.sqlite", tmp_path / "back.json")
+
+    songs = json.loads(json_file.read_text(encoding="utf-8"))
+    back = json.loads((tmp_path / "back.json").read_text(encoding="utf-8"))
+    assert back == songs
+
+
+def test_get_spotify_track_id_song_store_writes_once(tmp_path, monkeypatch):
+    updates = []
+    monkeypatch.setattr(
+        SongStore, "update_many", lambda self, keyed: updates.append(len(keyed))
+    )
+    songs = ({"artist": f"artist {i}", "title": f"song {i}"} for i in range(25))
+    db_file = tmp_path / "songs.sqlite"
+    sp = StubSpotify(latency=0)
+    get_spotify_track_id(sp, db_file, songs=songs, checkpoint_every=10)
+
+    # inserted once, then each batch written back once
+    assert updates == [10, 10, 5]
+
+
+def test_get_spotify_track_id_song_store_resume(tmp_path):
+    db_file = tmp_path / "songs.sqlite"
+    convert_songs(make_songs_json(tmp_path, 10), db_file)
+    try:
+        get_spotify_track_id(CrashingSpotify(6), db_file, workers=1)
+    except KeyboardInterrupt:
+        pass
+
+    # each match was written to the store as it was found
+    assert sum("spotify" in s for s in load_songs(db_file)) == 6
+
+    sp = StubSpotify(latency=0)
+    get_spotify_track_id(sp, db_file, resume=True, tiers=["strict"])
+    songs = list(load_songs(db_file))
+    assert sp.calls == 5
+    assert all("spotify" in s for s in songs[:-1])
+
+
+class ForgetfulSpotify(StubSpotify):
+    """StubSpotify that doesn't keep the queries it's sent"""
+
+    def search(self, *args, **kwargs):
+        result = super().search(*args, **kwargs)
+        self.queries.clear()
+        return result
+
+
+def test_get_spotify_track_id_song_store_memory_is_flat(tmp_path, monkeypatch):
+    monkeypatch.setattr("mltk.songstore.INSERT_BATCH_SIZE", 100)
+
+    def peak_memory(n_songs):
+        db_file = tmp_path / f"songs{n_songs}.sqlite"
+        # a few names repeated, so the memoized cleaning doesn't grow either
+        songs = (
+            {"artist": f"a{i % 50}", "title": f"t{i % 50}"} for i in range(n_songs)
+        )
+        tracemalloc.start()
+        get_spotify_track_id(ForgetfulSpotify(latency=0), db_file, songs=songs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    peak_memory(10)  # first use imports tqdm etc
+    assert peak_memory(3000) < 1.5 * peak_memory(300)
@@ -1,3 +1,13 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from spotipy.exceptions import SpotifyException
+from benchmarks.fake_spotify import FakeSpotify
+from .ratelimit import TokenBucket, call_with_backoff
+
 from .spotiply import *
 from .utils import *
 
@@ -19,3 +29,424 @@ def test_clean_artist():
 #         "title": "One More Time",
 #     }
 #     assert search_spotify_song(spotify_connect(), "afadsf", "adfsasdf") is None
+
+
+class StubSpotify:
+    """Stand-in for the spotipy client that answers searches after a delay"""
+
+    def __init__(self, latency=0.05, rate_limited=0):
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.calls = 0
+        self.queries = []
+
+    def search(self, q, limit=1, type="track"):
+        self.calls += 1
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            raise SpotifyException(429, -1, "rate limited", headers={"Retry-After": "0"})
+        time.sleep(self.latency)
+        self.queries.append(q)
+        if " artist:" not in q:
+            return {"tracks": {"items": []}}
+        title, artist = q.split(" artist:")
+        if title.startswith("missing"):
+            return {"tracks": {"items": []}}
+        track_id = f"{artist}{title}".replace(" ", "")
+        return {
+            "tracks": {
+                "items": [{"id": track_id, "name": title, "artists": [{"name": artist}]}]
+            }
+        }
+
+
+def make_songs_json(tmp_path, n_songs):
+    songs = [{"artist": f"artist {i}", "title": f"song {i}"} for i in range(n_songs)]
+    songs.append({"artist": "nobody", "title": "missing song"})
+    json_file = tmp_path / "songs.json"
+    json_file.write_text(json.dumps(songs), encoding="utf-8")
+    return json_file
+
+
+def test_get_spotify_track_id_keeps_order(tmp_path):
+    json_file = make_songs_json(tmp_path, 20)
+    songs = get_spotify_track_id(StubSpotify(latency=0.001), json_file, workers=8)
+
+    assert [s["spotify"]["id"] for s in songs[:-1]] == [
+        f"artist{i}song{i}" for i in range(20)
+    ]
+    assert "spotify" not in songs[-1]
+    assert (tmp_path / "songs-not_found.txt").read_text() == "nobody - missing song\n"
+    assert json.loads(json_file.read_text(encoding="utf-8")) == songs
+
+
+def test_get_spotify_track_id_saves_each_batch_once(tmp_path, monkeypatch):
+    json_file = make_songs_json(tmp_path, 20)
+    saves = []
+    monkeypatch.setattr(
+        "mltk.spotiply.dump_json_atomic", lambda songs, f: saves.append(len(songs))
+    )
+    get_spotify_track_id(StubSpotify(latency=0), json_file, checkpoint_every=10)
+
+    assert saves == [21, 21, 21]
+
+
+def test_get_spotify_track_id_concurrent_speedup(tmp_path):
+    json_file = make_songs_json(tmp_path, 20)
+
+    start = time.perf_counter()
+    get_spotify_track_id(StubSpotify(), json_file, workers=1)
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    get_spotify_track_id(StubSpotify(), json_file, workers=10)
+    concurrent = time.perf_counter() - start
+
+    assert concurrent < serial / 3
+
+
+def test_search_spotify_song_backs_off_on_429():
+    sp = StubSpotify(latency=0, rate_limited=2)
+    result = search_spotify_song(sp, "Daft Punk", "One More Time")
+
+    assert result["id"] == "daftpunkonemoretime"
+    assert sp.calls == 3
+
+
+def test_real_client_leaves_429s_to_call_with_backoff():
+    with FakeSpotify(throttle=1.0) as server:
+        sp = server.client()
+        try:
+            call_with_backoff(sp.search, q="a artist:b", type="track", max_retries=2)
+            assert False, "expected a 429"
+        except SpotifyException as e:
+            assert e.http_status == 429
+            assert "Retry-After" in e.headers
+
+        # one request per attempt, none retried inside the session
+        assert server.stats()["calls"] == {"search": 3}
+
+
+def test_get_spotify_track_id_uses_cache(tmp_path):
+    json_file = make_songs_json(tmp_path, 5)
+    cache_file = tmp_path / "cache.sqlite"
+    get_spotify_track_id(StubSpotify(latency=0), json_file, cache_file=cache_file)
+
+    sp = StubSpotify(latency=0)
+    songs = get_spotify_track_id(sp, json_file, cache_file=cache_file)
+
+    assert sp.calls == 0
+    assert songs[0]["spotify"]["id"] == "artist0song0"
+    assert "spotify" not in songs[-1]
+
+    # a new tier searches the songs missed before again, but only those
+    sp = StubSpotify(latency=0)
+    tiers = SEARCH_TIERS + ["title"]
+    get_spotify_track_id(sp, json_file, cache_file=cache_file, tiers=tiers)
+
+    assert sp.calls > 0
+    assert all("missing" in q for q in sp.queries)
+
+
+class CrashingSpotify(StubSpotify):
+    """Stub client that dies part way through a run"""
+
+    def __init__(self, crash_after):
+        super().__init__(latency=0)
+        self.crash_after = crash_after
+
+    def search(self, *args, **kwargs):
+        if self.calls == self.crash_after:
+            raise KeyboardInterrupt
+        return super().search(*args, **kwargs)
+
+
+def test_get_spotify_track_id_resume(tmp_path):
+    json_file = make_songs_json(tmp_path, 10)
+    try:
+        get_spotify_track_id(CrashingSpotify(6), json_file, workers=1)
+    except KeyboardInterrupt:
+        pass
+
+    songs = json.loads(json_file.read_text(encoding="utf-8"))
+    assert sum("spotify" in s for s in songs) == 6
+
+    sp = StubSpotify(latency=0)
+    songs = get_spotify_track_id(sp, json_file, resume=True, tiers=["strict"])
+
+    assert sp.calls == 5
+    assert all("spotify" in s for s in songs[:-1])
+
+
+def test_get_spotify_track_id_fallback_tiers(tmp_path):
+    songs = [
+        {"artist": "artist 0", "title": "song 0 (Extended Mix)"},
+        {"artist": "nobody", "title": "missing song (Dub)"},
+    ]
+    json_file = tmp_path / "songs.json"
+    json_file.write_text(json.dumps(songs), encoding="utf-8")
+
+    sp = StubSpotify(latency=0)
+    songs = get_spotify_track_id(
+        sp, json_file, workers=1, tiers=["strict", "remix", "loose"]
+    )
+
+    # only the song the strict query missed goes on to the later tiers
+    assert songs[0]["spotify"]["id"] == "artist0song0"
+    assert "spotify" not in songs[1]
+    assert sp.queries == [
+        "song 0 artist:artist 0",
+        "missing song artist:nobody",
+        "missing song dub artist:nobody",
+        "missing song nobody",
+    ]
+    assert (tmp_path / "songs-not_found.txt").read_text() == (
+        "nobody - missing song (Dub)\n"
+    )
+
+
+def test_get_spotify_track_id_tier_stats_skip_songs_not_searched(
+    tmp_path, monkeypatch
+):
+    songs = [
+        {"artist": "nobody", "title": "missing song"},
+        {"artist": "nobody", "title": "missing song (Dub)"},
+    ]
+    json_file = tmp_path / "songs.json"
+    json_file.write_text(json.dumps(songs), encoding="utf-8")
+    stats = {}
+    monkeypatch.setattr(
+        "mltk.spotiply.log_tier_stats",
+        lambda tier, n_searched, n_found, ms: stats.update(
+            {tier: (n_searched, sum(ms.values()))}
+        ),
+    )
+
+    sp = StubSpotify(latency=0)
+    get_spotify_track_id(sp, json_file, tiers=["strict", "remix", "loose"])
+
+    # the remix tier only applies to the song with a mix name, but both go on
+    assert stats == {"strict": (2, 2), "remix": (1, 1), "loose": (2, 2)}
+    assert sp.calls == 5
+
+
+def test_get_spotify_track_id_streamed_songs(tmp_path):
+    song = {"artist": "artist 0", "title": "song 0", "artists": ["artist 0", "x"]}
+    songs = iter([song])
+    json_file = tmp_path / "songs.json"
+
+    songs = get_spotify_track_id(StubSpotify(latency=0), json_file, songs=songs)
+
+    assert songs[0]["spotify"]["id"] == "artist0song0"
+    assert json.loads(json_file.read_text(encoding="utf-8")) == songs
+
+
+class FakePlaylistSpotify:
+    """Fake spotify client that records playlist changes and fails on cue"""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)  # per call: None, 429, or 500 (after adding)
+        self.playlists = {}
+        self.calls = []
+
+    def me(self):
+        return {"id": "me"}
+
+    def user_playlist_create(self, user, name, public=True):
+        self.playlists[name] = []
+        return {"id": name, "name": name}
+
+    def playlist_add_items(self, playlist_id, items):
+        self.calls.append(list(items))
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == 429:
+            raise SpotifyException(429, -1, "rate limited", headers={"Retry-After": "0"})
+        self.playlists[playlist_id] += items
+        if failure == 500:
+            raise SpotifyException(500, -1, "server error")
+        if failure == "gave up":
+            # spotipy's session running out of retries
+            raise SpotifyException(429, -1, "Max Retries")
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id, items):
+        if None in items:
+            raise TypeError("spotipy can't make a uri from None")
+        self.calls.append(("remove", list(items)))
+        self.playlists[playlist_id] = [
+            id for id in self.playlists[playlist_id] if id not in items
+        ]
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, additional_types=None):
+        items = [{"track": {"id": id}} for id in self.playlists[playlist_id]]
+        return {"items": items, "next": None}
+
+
+def test_add_tracks_to_playlist_retries_without_duplicates():
+    sp = FakePlaylistSpotify(failures=[None, 429, 500])
+    sp.user_playlist_create("me", "test")
+    track_ids = [f"id{i}" for i in range(250)]
+
+    add_tracks_to_playlist(sp, "test", track_ids, limiter=TokenBucket(rate=1000))
+
+    assert sp.playlists["test"] == track_ids
+    assert [len(c) for c in sp.calls] == [100, 100, 100, 50]
+
+
+def test_add_tracks_to_playlist_session_gave_up():
+    sp = FakePlaylistSpotify(failures=["gave up"])
+    sp.user_playlist_create("me", "test")
+    track_ids = [f"id{i}" for i in range(150)]
+
+    add_tracks_to_playlist(sp, "test", track_ids, limiter=TokenBucket(rate=1000))
+
+    # the tracks made it in, so the batch isn't added again
+    assert sp.playlists["test"] == track_ids
+    assert [len(c) for c in sp.calls] == [100, 50]
+
+
+def test_add_tracks_to_real_client_on_500():
+    with FakeSpotify(failures={"add_items": [500]}) as server:
+        sp = server.client()
+        playlist_id = sp.user_playlist_create("bench", "test", public=False)["id"]
+        track_ids = [f"id{i}" for i in range(150)]
+
+        add_tracks_to_playlist(
+            sp, playlist_id, track_ids, limiter=TokenBucket(rate=1000)
+        )
+
+        assert server.playlists[playlist_id] == track_ids
+        assert server.stats()["calls"]["add_items"] == 2
+
+
+def test_collect_track_ids():
+    songs = [{"spotify": {"id": id}} for id in ["b", "a", "b", "c", "a"]]
+    songs.insert(2, {"artist": "nobody", "title": "missing song"})
+
+    track_ids, counts = collect_track_ids(iter(songs))
+
+    assert track_ids == ["b", "a", "c"]
+    assert counts == {"songs": 6, "found": 5, "unique": 3}
+
+
+def test_create_and_sync_playlist(tmp_path):
+    json_file = make_songs_json(tmp_path, 150)
+    songs = get_spotify_track_id(StubSpotify(latency=0), json_file)
+    sp = FakePlaylistSpotify()
+
+    playlist_id = create_spotify_playlist(sp, "crate", songs=songs)
+    assert len(sp.playlists[playlist_id]) == 150
+
+    sp.calls = []
+    songs = songs[5:] + [{"spotify": {"id": "new"}}]
+    assert sync_spotify_playlist(sp, playlist_id, songs=songs) == (
+        ["new"],
+        [f"artist{i}song{i}" for i in range(5)],
+    )
+    assert sp.playlists[playlist_id] == collect_track_ids(songs)[0]
+    assert len(sp.calls) == 2
+
+
+def test_sync_playlist_with_local_file(tmp_path):
+    sp = FakePlaylistSpotify()
+    sp.user_playlist_create("me", "crate")
+    # local files (and unavailable tracks) come back with no id
+    sp.playlists["crate"] = ["a", None, "b"]
+
+    songs = [{"spotify": {"id": id}} for id in ["b", "c"]]
+    assert sync_spotify_playlist(sp, "crate", songs=songs) == (["c"], ["a"])
+    assert sp.playlists["crate"] == [None, "b", "c"]
+
+
+class FakeLibrarySpotify:
+    """Fake spotify client serving a paged library of saved tracks"""
+
+    def __init__(self, n_tracks, latency=0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        artists = [{"name": "a"}, {"name": "b"}]
+        self.tracks = [
+            {"track": {"id": f"id{i}", "name": f"song {i}", "artists": artists}}
+            for i in range(n_tracks)
+        ]
+        self.calls = 0
+
+    def current_user_saved_tracks(self, limit=20, offset=0):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        next = {"offset": offset + limit, "limit": limit}
+        return {
+            "items": self.tracks[offset : offset + limit],
+            "total": len(self.tracks),
+            "next": next if offset + limit < len(self.tracks) else None,
+        }
+
+    def next(self, response):
+        return self.current_user_saved_tracks(**response["next"])
+
+
+def test_get_liked_songs(tmp_path):
+    sp = FakeLibrarySpotify(120)
+
+    get_liked_songs(sp, tmp_path / "liked.csv")
+    get_liked_songs(sp, tmp_path / "liked.jsonl", fmt="jsonl")
+
+    assert sp.calls == 6  # no extra request for an empty last page
+    lines = (tmp_path / "liked.csv").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 121
+    assert lines[1] == f"1\tsong 0\ta, b\tid0\t{SPOTIFY_TRACK_URL}id0"
+    rows = [json.loads(l) for l in (tmp_path / "liked.jsonl").read_text().splitlines()]
+    assert [r["Num"] for r in rows] == list(range(1, 121))
+    assert rows[-1]["TrackID"] == "id119"
+
+
+def test_get_liked_songs_prefetch(tmp_path):
+    sp = FakeLibrarySpotify(250, latency=0.05)
+
+    get_liked_songs(sp, tmp_path / "liked.jsonl", fmt="jsonl", workers=3)
+
+    assert sp.max_in_flight == 3
+    rows = [json.loads(l) for l in (tmp_path / "liked.jsonl").read_text().splitlines()]
+    assert [r["TrackID"] for r in rows] == [f"id{i}" for i in range(250)]
+
+
+def test_most_frequent_ties_go_to_first_seen():
+    assert most_frequent(["b", "a", "a", "b", "c"]) == "b"
+    assert most_frequent([]) is None
+
+
+def test_weighted_vote():
+    assert weighted_vote([("a", 1), ("b", 3), (None, 5), ("a", 1)]) == ("b", 0.6)
+    assert weighted_vote([]) == (None, 0.0)
+
+
+def test_lazy_spotify_connects_on_first_use():
+    connects = []
+    sp = LazySpotify(lambda: connects.append(1) or StubSpotify(latency=0))
+    assert connects == []
+
+    search_spotify_song(sp, "Daft Punk", "One More Time")
+    search_spotify_song(sp, "Daft Punk", "Aerodynamic")
+    assert connects == [1]
+    assert sp.calls == 2
+
+
+def test_startup_skips_slow_imports():
+    # importing main (eg for --help) shouldn't load spotipy, requests etc
+    slow_modules = {"spotipy", "requests", "bs4", "numpy", "eyed3", "tqdm", "rapidfuzz"}
+    code = "import main, sys; print(*SLOW_MODULES & set(sys.modules))"
+    code = code.replace("SLOW_MODULES", repr(slow_modules))
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert out.stdout.strip() == ""
@@ -1,33 +1,61 @@
-import re
-
-
-def clean_song_title(title):
-    if title:
-        title = re.sub(r"\([^\)]*\)", "", title)
-        title = re.sub(r"\[[^\]]*\]", "", title)
-        title = re.sub(r"[^0-9a-zA-Z ]+", "", title.lower())
-        return title.strip()
-    else:
-        return None
-
-
-def clean_artist(artist):
-    if artist:
-        artist = (
-            artist.lower()
-            .split(" ft ")[0]
-            .split(" feat ")[0]
-            .split(" & ")[0]
-            .split(" vs ")[0]
-        )
-        artist = re.sub(r"[^0-9a-zA-Z ]+", "", artist.lower())
-        return artist.strip()
-    else:
-        return None
-
-
-def most_frequent(list):
-    if len(list) > 0:
-        return max(set(list), key=list.count)
-    else:
-        return None
+import json
+import os
+import tempfile
+from collections import Counter
+
+# my modules
+# the text cleaning lives in normalize, re-exported here for existing imports
+from .normalize import clean_artist, clean_song_title, remove_accents  # noqa: F401
+from .metrics import metrics
+
+
+def batched(items, n):
+    """Lists of up to n of items at a time, as they come"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def most_frequent(items):
+    """The most common of items, ties going to the one seen first"""
+    counts = Counter(items)
+    return max(counts, key=counts.get) if counts else None
+
+
+def weighted_vote(votes):
+    """
+    Tally (item, weight) votes, ignoring None items.
+    Returns the item with the most weight, ties going to the one seen first,
+    and its share of the total weight. (None, 0.0) if there are no votes.
+    """
+    tally = Counter()
+    for item, weight in votes:
+        if item is not None:
+            tally[item] += weight
+
+    if not tally:
+        return None, 0.0
+    top = max(tally, key=tally.get)
+    total = sum(tally.values())
+    return top, tally[top] / total if total else 0.0
+
+
+def dump_json_atomic(obj, file, indent=4):
+    """
+    Write obj as json to file via a temp file in the same directory, so the
+    file is either fully updated or left as it was if we're interrupted.
+    """
+    dir = os.path.dirname(os.path.abspath(file))
+    fd, tmp_file = tempfile.mkstemp(dir=dir, prefix=".", suffix=".tmp")
+    try:
+        with metrics.timer("write.json"), os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=indent)
+        os.replace(tmp_file, file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise